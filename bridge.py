@@ -1,28 +1,32 @@
-from web3 import Web3
-from web3.contract import Contract
-from web3.providers.rpc import HTTPProvider
-from web3.middleware import geth_poa_middleware  # Necessary for POA chains
 import json
+import os
 import sys
+import time
 from pathlib import Path
 
+from web3.exceptions import TransactionNotFound
+
+from connections import get_web3
+from event_decoder import EventDecoder, LogQuery
+from fee_oracle import GasEstimateError, get_fee_oracle
+from nonce_manager import NonceManager
+from relay_ledger import RelayLedger, entry_status, relay_hashes, ABANDONED
+from reorg import BlockHashCache, confirmation_depth
+
 source_chain = 'avax'
 destination_chain = 'bsc'
 contract_info = "contract_info.json"
+checkpoint_file = "bridge_checkpoint.json"
+warden_key = '0x3077c2142570543b96c1d396cb50bff8602c207d3ea090ace8ad6da01c903927'
 
+_event_decoder = None
 
-def connectTo(chain):
-    if chain == 'avax':
-        api_url = f"https://api.avax-test.network/ext/bc/C/rpc"  # AVAX C-chain testnet
-
-    if chain == 'bsc':
-        api_url = f"https://data-seed-prebsc-1-s1.binance.org:8545/"  # BSC testnet
 
-    if chain in ['avax', 'bsc']:
-        w3 = Web3(Web3.HTTPProvider(api_url))
-        # inject the poa compatibility middleware to the innermost layer
-        w3.middleware_onion.inject(geth_poa_middleware, layer=0)
-    return w3
+def connectTo(chain):
+    """
+        Takes a chain ('avax' or 'bsc') and returns the shared, PoA-enabled web3 instance for it
+    """
+    return get_web3(chain)
 
 
 def getContractInfo(chain):
@@ -43,35 +47,74 @@ def getContractInfo(chain):
     return contracts[chain]
 
 
-def scanBlocks(chain):
+def loadCheckpoint(chain):
     """
-        chain - (string) should be either "source" or "destination"
-        Scan the last 5 blocks of the source and destination chains
-        Look for 'Deposit' events on the source chain and 'Unwrap' events on the destination chain
-        When Deposit events are found on the source chain, call the 'wrap' function the destination chain
-        When Unwrap events are found on the destination chain, call the 'withdraw' function on the source chain
+        chain - (string) either "source" or "destination"
+        Returns the last block number on that chain whose events have been fully relayed,
+        or None if the relay has never completed a range there
     """
+    p = Path(__file__).with_name(checkpoint_file)
+    if not p.exists():
+        return None
+    try:
+        with p.open('r') as f:
+            checkpoints = json.load(f)
+    except Exception as e:
+        print(f"Failed to read checkpoint file {p}: {e}")
+        return None
 
-    import time
+    return checkpoints.get(chain)
 
-    if chain not in ['source', 'destination']:
-        print(f"Invalid chain: {chain}")
-        return
 
-    print(f"\n=== Starting scan for {chain} chain ===")
+def saveCheckpoint(chain, block_number):
+    """
+        Records block_number as the last fully relayed block for chain
+        The file is rewritten through a temporary file so a crash never leaves a torn checkpoint
+    """
+    p = Path(__file__).with_name(checkpoint_file)
+    checkpoints = {}
+    if p.exists():
+        try:
+            with p.open('r') as f:
+                checkpoints = json.load(f)
+        except Exception as e:
+            print(f"Discarding unreadable checkpoint file {p}: {e}")
 
-    # Connect to appropriate chains and get contract info
+    checkpoints[chain] = block_number
+    tmp = p.with_suffix('.tmp')
+    with tmp.open('w') as f:
+        json.dump(checkpoints, f)
+    os.replace(tmp, p)
+
+
+def getEventDecoder():
+    """
+        Returns the raw log decoder for every event in contract_info.json, built on first use
+    """
+    global _event_decoder
+    if _event_decoder is None:
+        _event_decoder = EventDecoder.from_contract_info()
+    return _event_decoder
+
+
+def getRelayContext(chain):
+    """
+        chain - (string) should be either "source" or "destination"
+        Connects to the watched chain and the chain we act on, and returns a dictionary holding
+        both web3 instances, both contract objects and the warden account
+    """
     if chain == 'source':
-        w3 = connectTo('avax')
-        contract_data = getContractInfo('source')
-        watching_chain = 'source'
+        network = source_chain
+        w3 = connectTo(source_chain)
         action_chain = 'destination'
+        action_w3 = connectTo(destination_chain)
     else:
-        w3 = connectTo('bsc')
-        contract_data = getContractInfo('destination')
-        watching_chain = 'destination'
+        network = destination_chain
+        w3 = connectTo(destination_chain)
         action_chain = 'source'
+        action_w3 = connectTo(source_chain)
 
+    contract_data = getContractInfo(chain)
     print(f"Connected to {chain} chain")
     print(f"Contract address: {contract_data['address']}")
 
@@ -81,7 +124,6 @@ def scanBlocks(chain):
         abi=contract_data['abi']
     )
 
-    action_w3 = connectTo('avax' if action_chain == 'source' else 'bsc')
     action_contract_data = getContractInfo(action_chain)
     action_contract = action_w3.eth.contract(
         address=action_w3.to_checksum_address(action_contract_data['address']),
@@ -89,155 +131,367 @@ def scanBlocks(chain):
     )
 
     # Set up account
-    private_key = '0x3077c2142570543b96c1d396cb50bff8602c207d3ea090ace8ad6da01c903927'
-    account = action_w3.eth.account.from_key(private_key)
+    account = action_w3.eth.account.from_key(warden_key)
     print(f"Using account: {account.address}")
 
-    if chain == 'source':
-        current_block = w3.eth.block_number
-        from_block = current_block - 4
-        print(
-            f"Scanning blocks {from_block} to {current_block} on {chain} chain")
+    ledger = RelayLedger()
+
+    def recordReplacement(label, tx_hash):
+        ledger.mark_sent(chain, label[0], label[1], tx_hash.hex())
+
+    return {
+        'chain': chain,
+        'network': network,
+        'w3': w3,
+        'contract': watching_contract,
+        # Deposit / Unwrap logs are fetched and decoded without web3's contract event machinery
+        'logs': LogQuery(w3, watching_contract.address, 'Deposit' if chain == 'source' else 'Unwrap',
+                         getEventDecoder()),
+        'action_chain': action_chain,
+        'action_w3': action_w3,
+        'action_contract': action_contract,
+        'account': account,
+        'private_key': warden_key,
+        'fee_oracle': get_fee_oracle(destination_chain if action_chain == 'destination' else source_chain, action_w3),
+        'nonce_manager': NonceManager(action_w3, account, warden_key, on_replace=recordReplacement),
+        'ledger': ledger,
+    }
+
+
+def eventKey(event):
+    """
+        Identifies an event log by (transaction hash, log index)
+    """
+    return event['transactionHash'].hex(), event['logIndex']
+
 
+def ledgerStatus(ctx, event):
+    """
+        Consults the relay ledger before acting on an event
+        Returns 'relay' if the event still has to be relayed with a new nonce, 'resend' if its earlier
+        relay has to be re-broadcast with the same nonce, 'done' if an earlier relay succeeded,
+        'in_flight' if an earlier relay transaction is still waiting to be mined and 'abandoned'
+        if its relays reverted too many times to try again
+    """
+    tx_hash, log_index = eventKey(event)
+    ledger = ctx['ledger']
+    entry = ledger.get(ctx['chain'], tx_hash, log_index)
+    status = entry_status(entry)
+    if status is not None:
+        return status
+
+    # Sent by an earlier pass, find out what happened to the relay transaction or its replacements
+    # (they share a nonce, so at most one of them is mined). The nonce is read first, so a relay
+    # mined in between shows up as a receipt rather than as a nonce taken by someone else
+    action_w3 = ctx['action_w3']
+    latest_nonce = action_w3.eth.get_transaction_count(ctx['account'].address, 'latest')
+    receipts = {}
+    known = False
+    for relay_hash in relay_hashes(entry):
         try:
-            deposit_events = watching_contract.events.Deposit().get_logs(
-                fromBlock=from_block,
-                toBlock=current_block
+            receipts[relay_hash] = action_w3.eth.get_transaction_receipt(relay_hash)
+        except TransactionNotFound:
+            try:
+                action_w3.eth.get_transaction(relay_hash)
+                known = True
+            except TransactionNotFound:
+                pass
+    return ledger.resolve_sent(ctx['chain'], tx_hash, log_index, receipts, latest_nonce, known,
+                               stuck_timeout=ctx['nonce_manager'].stuck_timeout)
+
+
+def submitRelayCalls(ctx, calls, verb):
+    """
+        calls - list of (event, contract_function, description) to execute on the action chain
+        Events already relayed according to the ledger are skipped. The rest are signed and broadcast
+        back-to-back with locally reserved nonces, then all of the receipts are awaited together
+        Returns the number of events that are not yet relayed successfully
+    """
+    nonce_manager = ctx['nonce_manager']
+    ledger = ctx['ledger']
+    chain = ctx['chain']
+
+    failures = 0
+    pending_calls = []
+    for event, contract_function, description in calls:
+        status = ledgerStatus(ctx, event)
+        if status == 'done':
+            print(f"Skipping already relayed event {eventKey(event)}")
+        elif status == 'abandoned':
+            # Reported and skipped, so a permanently reverting call does not hold back the checkpoint
+            print(f"Skipping abandoned event {eventKey(event)}: {description}")
+        elif status == 'in_flight':
+            print(f"Relay transaction for event {eventKey(event)} is still pending")
+            failures += 1
+        elif status == 'resend':
+            # Not mined and its nonce is still free: replace it under the same nonce, never a new one
+            entry = ledger.get(chain, *eventKey(event))
+            pending_calls.append((event, contract_function, description, entry['relay_nonce']))
+        else:
+            pending_calls.append((event, contract_function, description, None))
+
+    if not pending_calls:
+        return failures
+
+    sent = {}
+    for event, contract_function, description, nonce in pending_calls:
+        label = eventKey(event)
+        if nonce is None:
+            ledger.mark_pending(chain, label[0], label[1], block_number=event['blockNumber'])
+        try:
+            tx_params = ctx['fee_oracle'].tx_params(contract_function, ctx['account'].address)
+            tx_hash = nonce_manager.send(
+                contract_function, tx_params, label=label, nonce=nonce,
+                on_signed=lambda signed_hash, signed_nonce, label=label: ledger.mark_sent(
+                    chain, label[0], label[1], signed_hash.hex(), signed_nonce)
             )
-            print(f"Found {len(deposit_events)} Deposit events")
-
-            for event in deposit_events:
-                try:
-                    nonce = action_w3.eth.get_transaction_count(
-                        account.address)
-                    print(
-                        f"Processing Deposit: Amount={event['args']['amount']}, Recipient={event['args']['recipient']}")
-
-                    tx = action_contract.functions.wrap(
-                        event['args']['token'],
-                        event['args']['recipient'],
-                        event['args']['amount']
-                    ).build_transaction({
-                        'from': account.address,
-                        'gas': 200000,
-                        'gasPrice': action_w3.eth.gas_price,
-                        'nonce': nonce,
-                    })
-
-                    signed_tx = action_w3.eth.account.sign_transaction(tx,
-                                                                       private_key)
-                    tx_hash = action_w3.eth.send_raw_transaction(
-                        signed_tx.rawTransaction)
-                    print(f"Sent wrap transaction: {tx_hash.hex()}")
-
-                    receipt = action_w3.eth.wait_for_transaction_receipt(
-                        tx_hash)
-                    print(
-                        f"Wrap transaction confirmed in block {receipt['blockNumber']}")
-                    print(
-                        f"Wrapped {event['args']['amount']} tokens for {event['args']['recipient']}")
-
-                except Exception as e:
-                    print(f"Failed to wrap tokens: {e}")
+            print(f"Sent {verb} transaction: {tx_hash.hex()}")
+            sent[label] = description
+        except GasEstimateError as e:
+            # Nothing was sent. Not counted as an attempt (the revert may be transient, e.g. the
+            # other side not funded yet), the event stays unrelayed and is retried on the next pass
+            failures += 1
+            print(f"Failed to {verb} tokens: {e}")
+        except Exception as e:
+            # Not counted as an attempt, the ledger resolves any recorded hash on the next pass
+            failures += 1
+            print(f"Failed to {verb} tokens: {e}")
+
+    if not sent:
+        return failures
+
+    receipts = nonce_manager.wait_for_receipts()
+    for label, description in sent.items():
+        receipt = receipts.get(label)
+        if receipt is None:
+            # Still in flight, the ledger keeps it as sent for the next pass
+            failures += 1
+            print(f"{verb.capitalize()} transaction for {description} was not confirmed yet")
+            continue
+        if receipt['status'] != 1:
+            state = ledger.mark_failed(chain, label[0], label[1], f"reverted in {receipt['transactionHash'].hex()}")
+            if state == ABANDONED:
+                print(f"{verb.capitalize()} transaction for {description} reverted, giving up on {label}")
+            else:
+                failures += 1
+                print(f"{verb.capitalize()} transaction for {description} reverted")
+            continue
+        ledger.mark_confirmed(chain, label[0], label[1], receipt['transactionHash'].hex())
+        print(
+            f"{verb.capitalize()} transaction confirmed in block {receipt['blockNumber']}")
+        print(description)
+
+    return failures
 
+
+def relayDeposits(ctx, from_block, to_block):
+    """
+        Looks for 'Deposit' events on the source chain in [from_block, to_block]
+        and calls 'wrap' on the destination chain for each of them
+        Errors fetching the logs are raised to the caller, returns the number of events that failed to relay
+    """
+    action_contract = ctx['action_contract']
+
+    deposit_events = ctx['logs'].get_logs(
+        fromBlock=from_block,
+        toBlock=to_block
+    )
+    print(f"Found {len(deposit_events)} Deposit events")
+
+    calls = []
+    for event in deposit_events:
+        print(
+            f"Processing Deposit: Amount={event['args']['amount']}, Recipient={event['args']['recipient']}")
+        calls.append((
+            event,
+            action_contract.functions.wrap(
+                event['args']['token'],
+                event['args']['recipient'],
+                event['args']['amount']
+            ),
+            f"Wrapped {event['args']['amount']} tokens for {event['args']['recipient']}"
+        ))
+
+    return submitRelayCalls(ctx, calls, 'wrap')
+
+
+def relayUnwraps(ctx, from_block, to_block):
+    """
+        Looks for 'Unwrap' events on the destination chain in [from_block, to_block]
+        and calls 'withdraw' on the source chain for each of them
+        Errors fetching the logs are raised to the caller, returns the number of events that failed to relay
+    """
+    action_contract = ctx['action_contract']
+
+    # A single topic-filtered eth_getLogs over the whole range, instead of a receipt per transaction
+    unwrap_events = ctx['logs'].get_logs(
+        fromBlock=from_block,
+        toBlock=to_block
+    )
+    print(f"Found {len(unwrap_events)} Unwrap events")
+
+    calls = []
+    for event in unwrap_events:
+        print("\n=== Found Unwrap Event ===")
+        print(f"Underlying token: {event['args']['underlying_token']}")
+        print(f"To: {event['args']['to']}")
+        print(f"Amount: {event['args']['amount']}")
+        calls.append((
+            event,
+            action_contract.functions.withdraw(
+                event['args']['underlying_token'],
+                event['args']['to'],
+                event['args']['amount']
+            ),
+            f"Withdrew {event['args']['amount']} tokens for {event['args']['to']}"
+        ))
+
+    return submitRelayCalls(ctx, calls, 'withdraw')
+
+
+def scanBlocks(chain, confirmations=0):
+    """
+        chain - (string) should be either "source" or "destination"
+        confirmations - (int) how many blocks below the head the scanned window ends
+        Scan the last 5 blocks of the source and destination chains
+        Look for 'Deposit' events on the source chain and 'Unwrap' events on the destination chain
+        When Deposit events are found on the source chain, call the 'wrap' function the destination chain
+        When Unwrap events are found on the destination chain, call the 'withdraw' function on the source chain
+    """
+
+    if chain not in ['source', 'destination']:
+        print(f"Invalid chain: {chain}")
+        return
+
+    print(f"\n=== Starting scan for {chain} chain ===")
+
+    ctx = getRelayContext(chain)
+
+    if chain == 'source':
+        try:
+            current_block = ctx['w3'].eth.block_number - confirmations
+            from_block = current_block - 4
+            print(
+                f"Scanning blocks {from_block} to {current_block} on {chain} chain")
+            relayDeposits(ctx, from_block, current_block)
         except Exception as e:
             print(f"Failed to get Deposit events: {e}")
 
     else:  # destination chain (BSC)
         try:
-            current_block = w3.eth.block_number
+            current_block = ctx['w3'].eth.block_number - confirmations
             # Scan current block and previous block to ensure we catch the event
-            blocks_to_scan = [current_block - 1, current_block]
-
-            print(f"Scanning blocks {blocks_to_scan} on {chain} chain")
-
-            for block_number in blocks_to_scan:
-                print(f"\nProcessing block {block_number}")
-                try:
-                    # Get full block with transactions
-                    block = w3.eth.get_block(block_number,
-                                             full_transactions=True)
-                    print(
-                        f"Retrieved block with {len(block['transactions'])} transactions")
-
-                    contract_address = watching_contract.address.lower()
-                    print(
-                        f"Looking for transactions to contract: {contract_address}")
-
-                    for tx in block['transactions']:
-                        tx_hash = tx.hash if hasattr(tx, 'hash') else tx[
-                            'hash']
-                        print(f"\nChecking transaction: {tx_hash.hex()}")
-
-                        # Get transaction receipt directly
-                        try:
-                            receipt = w3.eth.get_transaction_receipt(tx_hash)
-                            if receipt['to'] and receipt[
-                                'to'].lower() == contract_address:
-                                print("Found transaction to our contract")
-
-                                # Check logs for Unwrap event
-                                for log in receipt.logs:
-                                    if log[
-                                        'address'].lower() == contract_address:
-                                        try:
-                                            event = watching_contract.events.Unwrap().process_log(
-                                                log)
-                                            print(
-                                                "\n=== Found Unwrap Event ===")
-                                            print(
-                                                f"Underlying token: {event['args']['underlying_token']}")
-                                            print(f"To: {event['args']['to']}")
-                                            print(
-                                                f"Amount: {event['args']['amount']}")
-
-                                            # Build withdraw transaction
-                                            nonce = action_w3.eth.get_transaction_count(
-                                                account.address)
-                                            withdraw_tx = action_contract.functions.withdraw(
-                                                event['args'][
-                                                    'underlying_token'],
-                                                event['args']['to'],
-                                                event['args']['amount']
-                                            ).build_transaction({
-                                                'from': account.address,
-                                                'gas': 200000,
-                                                'gasPrice': action_w3.eth.gas_price,
-                                                'nonce': nonce,
-                                            })
-
-                                            print("Built withdraw transaction")
-
-                                            # Sign and send transaction
-                                            signed_tx = action_w3.eth.account.sign_transaction(
-                                                withdraw_tx, private_key)
-                                            withdraw_hash = action_w3.eth.send_raw_transaction(
-                                                signed_tx.rawTransaction)
-                                            print(
-                                                f"Sent withdraw transaction: {withdraw_hash.hex()}")
-
-                                            receipt = action_w3.eth.wait_for_transaction_receipt(
-                                                withdraw_hash)
-                                            print(
-                                                f"Withdraw transaction confirmed in block {receipt['blockNumber']}")
-                                            print(
-                                                f"Withdrew {event['args']['amount']} tokens for {event['args']['to']}")
-                                            return  # Exit after processing the Unwrap event
-
-                                        except Exception as e:
-                                            print(
-                                                f"Error processing log as Unwrap event: {e}")
-                                            continue
-                        except Exception as e:
-                            print(
-                                f"Error getting receipt for transaction {tx_hash.hex()}: {e}")
-                            continue
-
-                except Exception as e:
-                    print(f"Error processing block {block_number}: {e}")
-                    continue
-
-            print("No Unwrap events found in scanned blocks")
-
+            print(
+                f"Scanning blocks {[current_block - 1, current_block]} on {chain} chain")
+            relayUnwraps(ctx, current_block - 1, current_block)
         except Exception as e:
-            print(f"Failed to process blocks: {e}")
\ No newline at end of file
+            print(f"Failed to get Unwrap events: {e}")
+
+
+def rollbackReorg(ctx, fork_block):
+    """
+        Called when the blocks after fork_block on the watched chain were replaced by a reorg
+        Rewinds the checkpoint to fork_block and drops unsent ledger entries above it, so the
+        replaced range is scanned again. Relays already sent for events above it are reported,
+        they cannot be undone but stay recorded so a re-included event is not relayed twice
+    """
+    rollbackRelays(ctx['chain'], ctx['ledger'], fork_block)
+
+
+def rollbackRelays(chain, ledger, fork_block):
+    """
+        rollbackReorg for callers holding the ledger directly, e.g. the async bridge
+    """
+    print(f"Reorg detected on {chain} chain, rolling back to block {fork_block}")
+    for entry in ledger.rollback(chain, fork_block):
+        print(f"Event {entry['tx_hash']}:{entry['log_index']} in reorged block {entry['block_number']} "
+              f"was already relayed by {' / '.join(relay_hashes(entry))} ({entry['state']})")
+    saveCheckpoint(chain, fork_block)
+
+
+def runRelay(chains=('source', 'destination'), poll_interval=5, start_blocks=None,
+             initial_chunk=100, min_chunk=1, max_chunk=2000):
+    """
+        Long running relay mode
+        chains - the chains to watch ("source" and/or "destination")
+        poll_interval - seconds to sleep once every watched chain has caught up to its head
+        start_blocks - optional dictionary {chain: block} used when a chain has no checkpoint yet,
+            otherwise a fresh chain starts at the same 5 block window as scanBlocks
+
+        Each chain resumes from the block after its checkpoint and scans forward in ranges whose size
+        doubles after a clean range and halves after a failed one. The checkpoint only advances once
+        every event in a range has been relayed, so a restart neither skips nor rescans finished ranges.
+        Ranges stop confirmation_depth blocks below the head, and the hashes of scanned blocks are
+        cached so a reorg below that depth is detected and rolled back before the next range.
+    """
+    for chain in chains:
+        if chain not in ['source', 'destination']:
+            print(f"Invalid chain: {chain}")
+            return
+
+    start_blocks = start_blocks or {}
+    contexts = {chain: getRelayContext(chain) for chain in chains}
+    chunk_sizes = {chain: initial_chunk for chain in chains}
+    handlers = {'source': relayDeposits, 'destination': relayUnwraps}
+    hash_caches = {chain: BlockHashCache() for chain in chains}
+    for chain in chains:
+        for entry in contexts[chain]['ledger'].abandoned(chain):
+            print(f"Abandoned event {entry['tx_hash']}:{entry['log_index']} in block {entry['block_number']} "
+                  f"after {entry['attempts']} attempts: {entry['last_error']}")
+
+    while True:
+        caught_up = True
+        for chain in chains:
+            ctx = contexts[chain]
+            try:
+                head = ctx['w3'].eth.block_number - confirmation_depth(ctx['network'])
+            except Exception as e:
+                print(f"Failed to get block number on {chain} chain: {e}")
+                continue
+
+            last_block = loadCheckpoint(chain)
+            if last_block is None:
+                last_block = start_blocks.get(chain, head - 4) - 1
+            from_block = last_block + 1
+            if from_block > head:
+                continue
+
+            try:
+                fork_block = hash_caches[chain].check(ctx['w3'], from_block)
+            except Exception as e:
+                print(f"Failed to check for reorgs on {chain} chain: {e}")
+                continue
+            if fork_block is not None:
+                rollbackReorg(ctx, fork_block)
+                caught_up = False
+                continue
+
+            to_block = min(from_block + chunk_sizes[chain] - 1, head)
+            print(f"Scanning blocks {from_block} to {to_block} on {chain} chain")
+            try:
+                failures = handlers[chain](ctx, from_block, to_block)
+            except Exception as e:
+                print(f"Failed to scan blocks {from_block} to {to_block} on {chain} chain: {e}")
+                failures = 1
+
+            if failures:
+                # Leave the checkpoint where it is and retry with a smaller range
+                chunk_sizes[chain] = max(min_chunk, chunk_sizes[chain] // 2)
+                continue
+
+            saveCheckpoint(chain, to_block)
+            try:
+                hash_caches[chain].record_block(ctx['w3'], to_block)
+            except Exception as e:
+                print(f"Failed to record hash of block {to_block} on {chain} chain: {e}")
+            if to_block - from_block + 1 == chunk_sizes[chain]:
+                chunk_sizes[chain] = min(max_chunk, chunk_sizes[chain] * 2)
+            if to_block < head:
+                caught_up = False
+
+        if caught_up:
+            time.sleep(poll_interval)
+
+
+if __name__ == "__main__":
+    runRelay()
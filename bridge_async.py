@@ -0,0 +1,357 @@
+import asyncio
+import sys
+import time
+
+from web3.exceptions import TransactionNotFound
+
+from bridge import (source_chain, destination_chain, warden_key, getContractInfo,
+                    loadCheckpoint, saveCheckpoint, eventKey, getEventDecoder, rollbackRelays)
+from connections import get_async_web3, ws_urls
+from event_decoder import AsyncLogQuery
+from fee_oracle import AsyncFeeOracle, GasEstimateError
+from nonce_manager import bump_fees
+from relay_ledger import RelayLedger, entry_status, relay_hashes, ABANDONED
+from reorg import BlockHashCache, confirmation_depth
+from ws_subscribe import HeadSubscription
+
+# (network, event watched on this chain, function called on the other chain)
+bridge_sides = {
+    'source': (source_chain, 'Deposit', 'wrap'),
+    'destination': (destination_chain, 'Unwrap', 'withdraw'),
+}
+
+
+def connectToAsync(chain):
+    """
+        Takes a network ('avax' or 'bsc') and returns the shared AsyncWeb3 instance for it
+    """
+    return get_async_web3(chain)
+
+
+def relayArgs(event):
+    """
+        Maps a Deposit or Unwrap event to the arguments of the matching wrap / withdraw call
+    """
+    args = event['args']
+    if event['event'] == 'Deposit':
+        return args['token'], args['recipient'], args['amount']
+    return args['underlying_token'], args['to'], args['amount']
+
+
+class AsyncBridge:
+    """
+        Watches the Source and Destination contracts in one process
+
+        Each watched chain has its own scan task which reads Deposit / Unwrap logs in checkpointed,
+        adaptively sized ranges and hands the events to the submission queue of the chain that has
+        to act on them. Each action chain has a single submitter task which owns the warden nonce
+        for that chain, broadcasts queued calls back-to-back and waits for their receipts in the
+        background, so a slow confirmation on one chain never stalls detection on the other.
+
+        With push=True the scanners are woken by eth_subscribe("newHeads") on the chains listed in
+        connections.ws_urls and fall back to polling whenever the WebSocket is down. The checkpointed
+        range scan fills any gap left by a reconnect.
+    """
+
+    def __init__(self, poll_interval=5, initial_chunk=100, min_chunk=1, max_chunk=2000,
+                 stuck_timeout=90, gas_bump=1.125, start_blocks=None, push=False):
+        self.poll_interval = poll_interval
+        self.initial_chunk = initial_chunk
+        self.min_chunk = min_chunk
+        self.max_chunk = max_chunk
+        self.stuck_timeout = stuck_timeout
+        self.gas_bump = max(gas_bump, 1.1)
+        self.start_blocks = start_blocks or {}
+        self.ledger = RelayLedger()
+
+        self.w3 = {}
+        self.contracts = {}
+        for chain, (network, _, _) in bridge_sides.items():
+            w3 = connectToAsync(network)
+            info = getContractInfo(chain)
+            self.w3[chain] = w3
+            self.contracts[chain] = w3.eth.contract(
+                address=w3.to_checksum_address(info['address']),
+                abi=info['abi']
+            )
+        self.account = self.w3['source'].eth.account.from_key(warden_key)
+        # Cached EIP-1559 (or legacy) fees and gas limits for the transactions sent on each chain
+        self.fee_oracles = {chain: AsyncFeeOracle(w3) for chain, w3 in self.w3.items()}
+        self.queues = {chain: asyncio.Queue() for chain in bridge_sides}
+        self.nonces = {}
+
+        # Push mode: new heads over WebSocket wake the scanners instead of a fixed poll interval
+        self.subscriptions = {}
+        if push:
+            for chain, (network, _, _) in bridge_sides.items():
+                if network in ws_urls:
+                    self.subscriptions[chain] = HeadSubscription(ws_urls[network])
+
+    @staticmethod
+    def other(chain):
+        return 'destination' if chain == 'source' else 'source'
+
+    async def run(self):
+        print(f"Using account: {self.account.address}")
+        await asyncio.gather(
+            *(subscription.run() for subscription in self.subscriptions.values()),
+            *(self.scan(chain) for chain in bridge_sides),
+            *(self.submit(chain) for chain in bridge_sides),
+        )
+
+    async def scan(self, chain):
+        """
+            Scan task for one watched chain
+            Ranges stop confirmation_depth blocks below the head, and the checkpoint only advances
+            once every event in a range has been relayed. As in bridge.runRelay, the hashes of
+            scanned blocks are cached so a reorg deeper than the confirmation depth is detected and
+            rolled back before the next range
+        """
+        w3 = self.w3[chain]
+        _, event_name, _ = bridge_sides[chain]
+        event = AsyncLogQuery(w3, self.contracts[chain].address, event_name, getEventDecoder())
+        queue = self.queues[self.other(chain)]
+        chunk = self.initial_chunk
+        hash_cache = BlockHashCache()
+
+        while True:
+            subscription = self.subscriptions.get(chain)
+            try:
+                if subscription is not None and subscription.connected and subscription.head is not None:
+                    latest = subscription.head
+                else:
+                    latest = await w3.eth.block_number
+            except Exception as e:
+                print(f"Failed to get block number on {chain} chain: {e}")
+                await asyncio.sleep(self.poll_interval)
+                continue
+            head = latest - confirmation_depth(bridge_sides[chain][0])
+
+            last_block = loadCheckpoint(chain)
+            if last_block is None:
+                last_block = self.start_blocks.get(chain, head - 4) - 1
+            from_block = last_block + 1
+            if from_block > head:
+                await self.idle(chain)
+                continue
+
+            try:
+                fork_block = await hash_cache.check_async(w3, from_block)
+            except Exception as e:
+                print(f"Failed to check for reorgs on {chain} chain: {e}")
+                await asyncio.sleep(self.poll_interval)
+                continue
+            if fork_block is not None:
+                rollbackRelays(chain, self.ledger, fork_block)
+                continue
+
+            to_block = min(from_block + chunk - 1, head)
+            try:
+                events = await event.get_logs(fromBlock=from_block, toBlock=to_block)
+                print(f"Found {len(events)} {event_name} events in blocks {from_block} to {to_block} on {chain} chain")
+                futures = []
+                for ev in events:
+                    future = asyncio.get_running_loop().create_future()
+                    await queue.put((chain, ev, future))
+                    futures.append(future)
+                relayed = all(await asyncio.gather(*futures))
+            except Exception as e:
+                print(f"Failed to scan blocks {from_block} to {to_block} on {chain} chain: {e}")
+                relayed = False
+
+            if not relayed:
+                # Leave the checkpoint where it is and retry with a smaller range
+                chunk = max(self.min_chunk, chunk // 2)
+                await asyncio.sleep(self.poll_interval)
+                continue
+
+            saveCheckpoint(chain, to_block)
+            try:
+                await hash_cache.record_block_async(w3, to_block)
+            except Exception as e:
+                print(f"Failed to record hash of block {to_block} on {chain} chain: {e}")
+            if to_block - from_block + 1 == chunk:
+                chunk = min(self.max_chunk, chunk * 2)
+
+    async def idle(self, chain):
+        """
+            Waits for the next block, pushed over WebSocket when subscribed and polled otherwise
+        """
+        subscription = self.subscriptions.get(chain)
+        if subscription is not None:
+            await subscription.wait_for_head(self.poll_interval)
+        else:
+            await asyncio.sleep(self.poll_interval)
+
+    async def ledger_status(self, watched_chain, ev, action_w3):
+        """
+            Async counterpart of bridge.ledgerStatus, returns 'relay', 'resend', 'done', 'in_flight' or 'abandoned'
+        """
+        tx_hash, log_index = eventKey(ev)
+        entry = self.ledger.get(watched_chain, tx_hash, log_index)
+        status = entry_status(entry)
+        if status is not None:
+            return status
+
+        latest_nonce = await action_w3.eth.get_transaction_count(self.account.address, 'latest')
+        receipts = {}
+        known = False
+        for relay_hash in relay_hashes(entry):
+            try:
+                receipts[relay_hash] = await action_w3.eth.get_transaction_receipt(relay_hash)
+            except TransactionNotFound:
+                try:
+                    await action_w3.eth.get_transaction(relay_hash)
+                    known = True
+                except TransactionNotFound:
+                    pass
+        return self.ledger.resolve_sent(watched_chain, tx_hash, log_index, receipts, latest_nonce, known,
+                                        stuck_timeout=self.stuck_timeout)
+
+    async def submit(self, action_chain):
+        """
+            Submitter task for one action chain
+            Drains whatever is queued, broadcasts it with consecutive local nonces and leaves
+            the receipts to background tasks so the queue keeps moving
+        """
+        queue = self.queues[action_chain]
+        w3 = self.w3[action_chain]
+        contract = self.contracts[action_chain]
+        waiters = set()
+
+        while True:
+            batch = [await queue.get()]
+            while not queue.empty():
+                batch.append(queue.get_nowait())
+
+            try:
+                if action_chain not in self.nonces:
+                    self.nonces[action_chain] = await w3.eth.get_transaction_count(self.account.address, 'pending')
+            except Exception as e:
+                print(f"Failed to prepare transactions on {action_chain} chain: {e}")
+                for _, _, future in batch:
+                    future.set_result(False)
+                continue
+
+            for watched_chain, ev, future in batch:
+                tx_hash, log_index = eventKey(ev)
+                try:
+                    status = await self.ledger_status(watched_chain, ev, w3)
+                except Exception as e:
+                    print(f"Failed to check relay ledger for {eventKey(ev)}: {e}")
+                    status = 'in_flight'
+                if status == 'abandoned':
+                    # Reported and skipped, a permanently reverting call must not hold back the checkpoint
+                    print(f"Skipping abandoned event {eventKey(ev)}")
+                if status not in ['relay', 'resend']:
+                    future.set_result(status in ['done', 'abandoned'])
+                    continue
+
+                _, _, function_name = bridge_sides[watched_chain]
+                if status == 'resend':
+                    # Not mined and its nonce is still free: replace it under the same nonce, never a new one
+                    nonce = self.ledger.get(watched_chain, tx_hash, log_index)['relay_nonce']
+                else:
+                    nonce = self.nonces[action_chain]
+                    self.ledger.mark_pending(watched_chain, tx_hash, log_index, block_number=ev['blockNumber'])
+                try:
+                    contract_function = getattr(contract.functions, function_name)(*relayArgs(ev))
+                    tx_params = await self.fee_oracles[action_chain].tx_params(contract_function, self.account.address)
+                    tx = await contract_function.build_transaction(dict(tx_params, nonce=nonce))
+                    sent_hash = await self.send(w3, tx, watched_chain, ev)
+                except GasEstimateError as e:
+                    # Nothing was sent and the nonce is still free. Not counted as an attempt, the
+                    # revert may be transient, so the event is retried on the next pass
+                    print(f"Failed to {function_name} tokens: {e}")
+                    future.set_result(False)
+                    continue
+                except Exception as e:
+                    # Not counted as an attempt, the ledger resolves any recorded hash on the next pass
+                    print(f"Failed to {function_name} tokens: {e}")
+                    # Re-read the nonce in case the account was used elsewhere
+                    self.nonces.pop(action_chain, None)
+                    future.set_result(False)
+                    break
+
+                if status == 'relay':
+                    self.nonces[action_chain] = nonce + 1
+                print(f"Sent {function_name} transaction on {action_chain} chain: {sent_hash.hex()}")
+                waiter = asyncio.create_task(self.confirm(w3, watched_chain, ev, tx, sent_hash, future))
+                waiters.add(waiter)
+                waiter.add_done_callback(waiters.discard)
+
+            # Anything left after a failed send goes back through the next batch
+            for item in batch:
+                if not item[2].done():
+                    await queue.put(item)
+
+    async def send(self, w3, tx, watched_chain, ev):
+        """
+            Signs tx and records its hash in the ledger before broadcasting it, so a crash in between
+            leaves the relay on record instead of looking unsent
+        """
+        signed_tx = w3.eth.account.sign_transaction(tx, warden_key)
+        tx_hash, log_index = eventKey(ev)
+        self.ledger.mark_sent(watched_chain, tx_hash, log_index, signed_tx.hash.hex(), tx['nonce'])
+        return await w3.eth.send_raw_transaction(signed_tx.rawTransaction)
+
+    async def confirm(self, w3, watched_chain, ev, tx, sent_hash, future):
+        """
+            Waits for a relay transaction, replacing it with the same nonce and bumped fees
+            whenever it stays unmined for stuck_timeout seconds (the async side of NonceManager.replace)
+        """
+        tx_hash, log_index = eventKey(ev)
+        hashes = [sent_hash]
+        sent_at = time.time()
+        while True:
+            receipt = None
+            for h in hashes:
+                try:
+                    receipt = await w3.eth.get_transaction_receipt(h)
+                    break
+                except TransactionNotFound:
+                    continue
+                except Exception as e:
+                    print(f"Failed to get receipt for {h.hex()}: {e}")
+
+            if receipt is not None:
+                break
+
+            if time.time() - sent_at > self.stuck_timeout:
+                try:
+                    gas_price = 0 if 'maxFeePerGas' in tx else await w3.eth.gas_price
+                    tx = bump_fees(tx, self.gas_bump, gas_price)
+                    new_hash = await self.send(w3, tx, watched_chain, ev)
+                    hashes.append(new_hash)
+                    print(f"Replaced stuck transaction with nonce {tx['nonce']}: {new_hash.hex()}")
+                except Exception as e:
+                    print(f"Failed to replace transaction with nonce {tx['nonce']}: {e}")
+                sent_at = time.time()
+
+            await asyncio.sleep(self.poll_interval)
+
+        if receipt['status'] == 1:
+            self.ledger.mark_confirmed(watched_chain, tx_hash, log_index, receipt['transactionHash'].hex())
+            print(f"Relayed {eventKey(ev)} in block {receipt['blockNumber']}")
+            future.set_result(True)
+        else:
+            state = self.ledger.mark_failed(watched_chain, tx_hash, log_index,
+                                            f"reverted in {receipt['transactionHash'].hex()}")
+            print(f"Relay transaction {receipt['transactionHash'].hex()} reverted")
+            if state == ABANDONED:
+                print(f"Giving up on {eventKey(ev)} after {self.ledger.max_attempts} reverted attempts")
+            future.set_result(state == ABANDONED)
+
+
+def runAsyncBridge(**kwargs):
+    """
+        Runs the async dual-chain bridge until interrupted, keyword arguments go to AsyncBridge
+    """
+    async def main():
+        await AsyncBridge(**kwargs).run()
+
+    asyncio.run(main())
+
+
+if __name__ == "__main__":
+    runAsyncBridge(push='--push' in sys.argv)
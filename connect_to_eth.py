@@ -1,7 +1,6 @@
 import json
-from web3 import Web3
-from web3.middleware import geth_poa_middleware
-from web3.providers.rpc import HTTPProvider
+
+from connections import get_web3
 
 '''If you use one of the suggested infrastructure providers, the url will be of the form
 now_url  = f"https://eth.nownodes.io/{now_token}"
@@ -12,7 +11,7 @@ infura_url = f"https://mainnet.infura.io/v3/{infura_token}"
 
 def connect_to_eth():
 	url = "https://mainnet.infura.io/v3/b55c529c669646afadfe3bbda28d03b2"  # FILL THIS IN
-	w3 = Web3(HTTPProvider(url))
+	w3 = get_web3(url=url)
 	assert w3.is_connected(), f"Failed to connect to provider at {url}"
 	return w3
 
@@ -27,15 +26,14 @@ def connect_with_middleware(contract_json):
 	# TODO complete this method
 	# The first section will be the same as "connect_to_eth()" but with a BNB url
 	url = "https://bsc-testnet.infura.io/v3/b55c529c669646afadfe3bbda28d03b2"
-	w3 = Web3(HTTPProvider(url))
-	assert w3.is_connected(), f"Failed to connect to provider at {url}"
 
 	# The second section requires you to inject middleware into your w3 object and
 	# create a contract object. Read more on the docs pages at https://web3py.readthedocs.io/en/stable/middleware.html
 	# and https://web3py.readthedocs.io/en/stable/web3.contract.html
 
-	# Inject the middleware for Proof of Authority (PoA) consensus
-	w3.middleware_onion.inject(geth_poa_middleware, layer=0)
+	# The shared connection comes with the Proof of Authority (PoA) middleware already injected
+	w3 = get_web3(url=url, poa=True)
+	assert w3.is_connected(), f"Failed to connect to provider at {url}"
 
 	# Create a contract object using the address and ABI
 	contract = w3.eth.contract(address=address, abi=abi)
@@ -0,0 +1,181 @@
+import threading
+import time
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+from web3 import Web3, AsyncWeb3
+from web3.middleware import geth_poa_middleware, async_geth_poa_middleware  # Necessary for POA chains
+
+from rpc_failover import FailoverHTTPProvider
+
+rpc_urls = {
+    'avax': "https://api.avax-test.network/ext/bc/C/rpc",  # AVAX C-chain testnet
+    'bsc': "https://data-seed-prebsc-1-s1.binance.org:8545/",  # BSC testnet
+}
+# Ranked endpoints per chain, the first one is the preferred endpoint
+rpc_endpoints = {
+    'avax': [
+        rpc_urls['avax'],
+        "https://avalanche-fuji-c-chain-rpc.publicnode.com",
+        "https://rpc.ankr.com/avalanche_fuji",
+    ],
+    'bsc': [
+        rpc_urls['bsc'],
+        "https://data-seed-prebsc-2-s1.binance.org:8545/",
+        "https://bsc-testnet-rpc.publicnode.com",
+    ],
+}
+# WebSocket endpoints used for push notifications of new blocks
+ws_urls = {
+    'avax': "wss://api.avax-test.network/ext/bc/C/ws",
+    'bsc': "wss://bsc-testnet-rpc.publicnode.com",
+}
+poa_chains = ['avax', 'bsc']
+
+# Keep-alive pool shared by every HTTP provider, set these before the first connection is made
+pool_size = 10
+request_timeout = 30
+# Seconds before a slow read is duplicated to the next endpoint, None disables hedging
+hedge_after = None
+
+_session = None
+_web3_cache = {}
+_async_web3_cache = {}
+_rate_limiters = {}
+_lock = threading.Lock()
+
+
+class RateLimiter:
+    """
+        Token bucket shared by every thread calling the same provider
+        acquire() blocks until a request may be sent without exceeding rate requests per second
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst if burst is not None else max(1, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def set_rate(self, rate, burst=None):
+        with self.lock:
+            self.rate = float(rate)
+            self.capacity = float(burst if burst is not None else max(1, rate))
+            self.tokens = min(self.tokens, self.capacity)
+
+    def acquire(self, tokens=1):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def get_rate_limiter(key, rate):
+    """
+        Returns the RateLimiter for a provider, keyed by its url (see rpc_batch.endpoint_uri) so every
+        caller of the same endpoint shares one limiter
+        Created on first use with rate requests per second, a later call with a different rate
+        changes the shared limiter to that rate
+    """
+    with _lock:
+        limiter = _rate_limiters.get(key)
+        if limiter is None:
+            limiter = _rate_limiters[key] = RateLimiter(rate)
+        elif limiter.rate != float(rate):
+            limiter.set_rate(rate)
+        return limiter
+
+
+def get_session():
+    """
+        Returns the requests.Session shared by all HTTP providers, so connections (and their TLS
+        handshakes) are reused across calls and across Web3 instances
+    """
+    global _session
+    with _lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _session = session
+        return _session
+
+
+def _resolve(chain, url, poa):
+    if url is None:
+        if chain not in rpc_urls:
+            raise ValueError(f"Unknown chain {chain}, pass an explicit url")
+        url = rpc_urls[chain]
+    if poa is None:
+        poa = chain in poa_chains
+    return url, poa
+
+
+def get_web3(chain=None, url=None, poa=None):
+    """
+        chain - 'avax' or 'bsc', or None when an explicit url is given
+        url - RPC endpoint, defaults to the endpoint for chain
+        poa - inject the PoA middleware, defaults to True for 'avax' and 'bsc'
+        Returns a Web3 instance cached per (url, poa), built on the shared keep-alive session
+        Chains with several entries in rpc_endpoints get a FailoverHTTPProvider over all of them
+        unless an explicit url is given
+    """
+    endpoints = rpc_endpoints.get(chain) if url is None else None
+    url, poa = _resolve(chain, url, poa)
+    key = (url, poa)
+    w3 = _web3_cache.get(key)
+    if w3 is not None:
+        return w3
+
+    request_kwargs = {'timeout': request_timeout}
+    if endpoints and len(endpoints) > 1:
+        provider = FailoverHTTPProvider(endpoints, session=get_session(), request_kwargs=request_kwargs,
+                                        hedge_after=hedge_after)
+    else:
+        provider = Web3.HTTPProvider(url, session=get_session(), request_kwargs=request_kwargs)
+    w3 = Web3(provider)
+    if poa:
+        # inject the poa compatibility middleware to the innermost layer
+        w3.middleware_onion.inject(geth_poa_middleware, layer=0)
+    with _lock:
+        return _web3_cache.setdefault(key, w3)
+
+
+def get_async_web3(chain=None, url=None, poa=None):
+    """
+        Async counterpart of get_web3, returns an AsyncWeb3 instance cached per (url, poa)
+    """
+    url, poa = _resolve(chain, url, poa)
+    key = (url, poa)
+    w3 = _async_web3_cache.get(key)
+    if w3 is not None:
+        return w3
+
+    provider = AsyncWeb3.AsyncHTTPProvider(
+        url, request_kwargs={'timeout': aiohttp.ClientTimeout(total=request_timeout)})
+    w3 = AsyncWeb3(provider)
+    if poa:
+        w3.middleware_onion.inject(async_geth_poa_middleware, layer=0)
+    return _async_web3_cache.setdefault(key, w3)
+
+
+def clear_cache():
+    """
+        Drops every cached Web3 instance and closes the shared session
+    """
+    global _session
+    with _lock:
+        _web3_cache.clear()
+        _async_web3_cache.clear()
+        if _session is not None:
+            _session.close()
+            _session = None
@@ -0,0 +1,188 @@
+import json
+from functools import lru_cache
+from pathlib import Path
+
+from eth_abi import decode as abi_decode
+from eth_utils import keccak, to_checksum_address
+from hexbytes import HexBytes
+from web3.datastructures import AttributeDict
+
+contract_info = "contract_info.json"
+
+
+@lru_cache(maxsize=4096)
+def checksum(raw_address):
+    """
+        Checksums a 20 byte address, cached since the same tokens and recipients keep coming back
+    """
+    return to_checksum_address(raw_address)
+
+
+def to_bytes(value):
+    if isinstance(value, str):
+        return bytes.fromhex(value[2:] if value.startswith('0x') else value)
+    return bytes(value)
+
+
+def word_decoder(abi_type):
+    """
+        Returns a function decoding one 32 byte word of a static ABI type, or None for other types
+    """
+    if abi_type == 'address':
+        return lambda word: checksum(word[12:])
+    if abi_type == 'bool':
+        return lambda word: word[-1] != 0
+    if abi_type.startswith('uint'):
+        return lambda word: int.from_bytes(word, 'big')
+    if abi_type.startswith('int'):
+        return lambda word: int.from_bytes(word, 'big', signed=True)
+    if abi_type.startswith('bytes') and abi_type != 'bytes':
+        size = int(abi_type[5:])
+        return lambda word: word[:size]
+    return None
+
+
+class EventSpec:
+    """
+        Precomputed decoding plan for one event signature
+    """
+
+    def __init__(self, abi):
+        self.name = abi['name']
+        inputs = abi['inputs']
+        signature = f"{self.name}({','.join(i['type'] for i in inputs)})"
+        self.topic = keccak(text=signature)
+
+        self.names = [i['name'] for i in inputs]
+        self.indexed = []
+        self.data = []
+        for position, item in enumerate(inputs):
+            decoder = word_decoder(item['type'])
+            if item['indexed']:
+                # Indexed dynamic values are only present as their hash, keep the raw topic
+                self.indexed.append((position, decoder or bytes))
+            else:
+                self.data.append((position, item['type'], decoder))
+        self.static_data = all(decoder is not None for _, _, decoder in self.data)
+
+    def decode_args(self, topics, data):
+        values = [None] * len(self.names)
+        for (position, decoder), topic in zip(self.indexed, topics[1:]):
+            values[position] = decoder(topic)
+
+        if self.static_data:
+            for offset, (position, _, decoder) in enumerate(self.data):
+                values[position] = decoder(data[32 * offset:32 * offset + 32])
+        elif self.data:
+            decoded = abi_decode([abi_type for _, abi_type, _ in self.data], data)
+            for (position, _, _), value in zip(self.data, decoded):
+                values[position] = value
+
+        return AttributeDict(dict(zip(self.names, values)))
+
+
+class EventDecoder:
+    """
+        Decodes raw logs straight from their topics and data bytes
+        The topic0 -> EventSpec table is built once from the event ABIs, so decoding a log is a
+        dictionary lookup plus slicing 32 byte words, with no web3 contract event objects involved
+        Decoded logs look like web3's: AttributeDicts with event, args, address, blockNumber,
+        blockHash, transactionHash, transactionIndex and logIndex
+    """
+
+    def __init__(self, abis):
+        self.specs = {}
+        self.topics = {}
+        for abi in abis:
+            for item in abi:
+                if item.get('type') != 'event' or item.get('anonymous'):
+                    continue
+                spec = EventSpec(item)
+                self.specs[spec.topic] = spec
+                self.topics[spec.name] = spec.topic
+
+    @classmethod
+    def from_contract_info(cls, path=None):
+        """
+            Builds a decoder for every event of every contract in contract_info.json
+        """
+        if path is None:
+            path = Path(__file__).with_name(contract_info)
+        with open(path, 'r') as f:
+            contracts = json.load(f)
+        return cls([c['abi'] for c in contracts.values()])
+
+    def topic(self, name):
+        """
+            Returns topic0 of the named event as a hex string
+        """
+        return '0x' + self.topics[name].hex()
+
+    def decode_log(self, log):
+        """
+            Decodes one log (raw JSON-RPC dict or web3 AttributeDict), returns None for unknown topics
+        """
+        topics = [to_bytes(t) for t in log['topics']]
+        if not topics:
+            return None
+        spec = self.specs.get(topics[0])
+        if spec is None:
+            return None
+
+        block_number = log['blockNumber']
+        log_index = log['logIndex']
+        transaction_index = log['transactionIndex']
+        return AttributeDict({
+            'event': spec.name,
+            'args': spec.decode_args(topics, to_bytes(log['data'])),
+            'address': checksum(to_bytes(log['address'])),
+            'blockNumber': int(block_number, 16) if isinstance(block_number, str) else block_number,
+            'blockHash': HexBytes(log['blockHash']),
+            'transactionHash': HexBytes(log['transactionHash']),
+            'transactionIndex': int(transaction_index, 16) if isinstance(transaction_index, str) else transaction_index,
+            'logIndex': int(log_index, 16) if isinstance(log_index, str) else log_index,
+        })
+
+    def decode_logs(self, logs):
+        """
+            Decodes a whole list of logs in one call, skipping logs with unknown topics
+        """
+        decoded = []
+        for log in logs:
+            event = self.decode_log(log)
+            if event is not None:
+                decoded.append(event)
+        return decoded
+
+
+class LogQuery:
+    """
+        Drop-in replacement for contract.events.<Name> when only get_logs is needed
+        Fetches logs with a single topic-filtered eth_getLogs and decodes them with an EventDecoder
+    """
+
+    def __init__(self, w3, address, event_name, decoder):
+        self.w3 = w3
+        self.address = address
+        self.event_name = event_name
+        self.decoder = decoder
+
+    def filter_params(self, fromBlock, toBlock):
+        return {
+            'address': self.address,
+            'topics': [self.decoder.topic(self.event_name)],
+            'fromBlock': fromBlock,
+            'toBlock': toBlock,
+        }
+
+    def get_logs(self, fromBlock, toBlock):
+        return self.decoder.decode_logs(self.w3.eth.get_logs(self.filter_params(fromBlock, toBlock)))
+
+
+class AsyncLogQuery(LogQuery):
+    """
+        LogQuery for AsyncWeb3 instances
+    """
+
+    async def get_logs(self, fromBlock, toBlock):
+        return self.decoder.decode_logs(await self.w3.eth.get_logs(self.filter_params(fromBlock, toBlock)))
@@ -0,0 +1,123 @@
+import csv
+import os
+from pathlib import Path
+
+deposit_columns = ['chain', 'block_number', 'token', 'recipient', 'amount', 'transactionHash']
+
+
+class CsvEventSink:
+    """
+        Appends decoded events to a CSV file without ever reading its existing rows
+        Rows are buffered and written batch_size at a time, so memory does not grow with the file
+
+        Use as a context manager (or call close()) so the last partial batch is flushed
+    """
+
+    def __init__(self, path, columns=deposit_columns, batch_size=500):
+        self.path = Path(path)
+        self.columns = list(columns)
+        self.batch_size = batch_size
+        self.buffer = []
+        self.rows_written = 0
+
+        exists = self.path.exists() and self.path.stat().st_size > 0
+        if exists:
+            with self.path.open('r', newline='') as f:
+                header = next(csv.reader(f), [])
+            # Older files used "transaction_hash", rows line up either way
+            legacy = [c if c != 'transactionHash' else 'transaction_hash' for c in self.columns]
+            if header not in [self.columns, legacy]:
+                raise ValueError(f"{self.path} has columns {header}, expected {self.columns}")
+
+        # True when the file starts out empty, nothing written earlier can be in it
+        self.new = not exists
+        self.file = self.path.open('a', newline='')
+        self.writer = csv.writer(self.file)
+        if not exists:
+            self.writer.writerow(self.columns)
+
+    def write(self, row):
+        """
+            row - dictionary with a value for every column
+        """
+        self.buffer.append([row[c] for c in self.columns])
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def write_many(self, rows):
+        for row in rows:
+            self.write(row)
+
+    def flush(self):
+        if self.buffer:
+            self.writer.writerows(self.buffer)
+            self.rows_written += len(self.buffer)
+            self.buffer = []
+        self.file.flush()
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class ParquetEventSink:
+    """
+        Appends decoded events to a Parquet dataset directory, one part file per flushed batch
+        Requires pyarrow. uint256 amounts do not fit an int64 column so every value is stored as a string
+    """
+
+    def __init__(self, path, columns=deposit_columns, batch_size=10000):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError as e:
+            raise ImportError("ParquetEventSink requires pyarrow (pip install pyarrow)") from e
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.columns = list(columns)
+        self.batch_size = batch_size
+        self.buffer = {c: [] for c in self.columns}
+        self.buffered = 0
+        self.rows_written = 0
+        self.part = len([p for p in os.listdir(self.path) if p.endswith('.parquet')])
+        self.new = self.part == 0
+
+    def write(self, row):
+        for c in self.columns:
+            self.buffer[c].append(str(row[c]))
+        self.buffered += 1
+        if self.buffered >= self.batch_size:
+            self.flush()
+
+    def write_many(self, rows):
+        for row in rows:
+            self.write(row)
+
+    def flush(self):
+        if not self.buffered:
+            return
+        table = self.pa.table({c: self.pa.array(v, type=self.pa.string()) for c, v in self.buffer.items()})
+        self.pq.write_table(table, self.path / f"part-{self.part:06d}.parquet")
+        self.part += 1
+        self.rows_written += self.buffered
+        self.buffer = {c: [] for c in self.columns}
+        self.buffered = 0
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,129 @@
+import sqlite3
+from pathlib import Path
+
+store_file = "event_store.db"
+
+
+class EventStore:
+    """
+        Embedded SQLite store for Deposit events
+        Each event is unique on (chain, transactionHash, log_index), so writing the same event twice is a
+        no-op and overlapping re-scans are idempotent. block_number, token and recipient are indexed
+        (addresses case-insensitively) for the query methods below.
+
+        Has the same write / flush / close interface as the event_sink classes
+        Nothing is committed until flush(), so a caller writing the same rows to a sink can commit them
+        here only once the sink has written them out
+    """
+
+    def __init__(self, path=None):
+        if path is None:
+            path = Path(__file__).with_name(store_file)
+        self.conn = sqlite3.connect(str(path))
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS deposits (
+                chain TEXT NOT NULL,
+                transactionHash TEXT NOT NULL,
+                log_index INTEGER NOT NULL,
+                block_number INTEGER NOT NULL,
+                token TEXT NOT NULL COLLATE NOCASE,
+                recipient TEXT NOT NULL COLLATE NOCASE,
+                amount TEXT NOT NULL,
+                UNIQUE (chain, transactionHash, log_index)
+            );
+            CREATE INDEX IF NOT EXISTS deposits_block ON deposits (chain, block_number);
+            CREATE INDEX IF NOT EXISTS deposits_token ON deposits (token);
+            CREATE INDEX IF NOT EXISTS deposits_recipient ON deposits (recipient);
+        """)
+        self.conn.commit()
+
+    def add(self, row):
+        """
+            row - dictionary with chain, transactionHash, log_index, block_number, token, recipient, amount
+            Returns True if the event was new, False if it was already stored
+        """
+        cursor = self.conn.execute("""
+            INSERT OR IGNORE INTO deposits (chain, transactionHash, log_index, block_number, token, recipient, amount)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (row['chain'], row['transactionHash'], row['log_index'], row['block_number'],
+              row['token'], row['recipient'], str(row['amount'])))
+        return cursor.rowcount == 1
+
+    def write(self, row):
+        self.add(row)
+
+    def write_many(self, rows):
+        for row in rows:
+            self.add(row)
+
+    def flush(self):
+        self.conn.commit()
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.flush()
+
+    def clear(self):
+        """
+            Deletes every stored event, e.g. when the sink the store deduplicates for starts out empty
+        """
+        self.conn.execute("DELETE FROM deposits")
+        self.conn.commit()
+
+    def rollback(self, chain, after_block):
+        """
+            Deletes every stored event on chain above after_block, returns the number of rows removed
+        """
+        cursor = self.conn.execute(
+            "DELETE FROM deposits WHERE chain = ? AND block_number > ?",
+            (chain, after_block)
+        )
+        self.conn.commit()
+        return cursor.rowcount
+
+    def query(self, chain=None, token=None, recipient=None, from_block=None, to_block=None):
+        """
+            Returns the stored deposits matching every given filter, in (block_number, log_index) order
+            Each result is a dictionary with the amount converted back to an int
+        """
+        clauses = []
+        params = []
+        for column, value in [('chain', chain), ('token', token), ('recipient', recipient)]:
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        if from_block is not None:
+            clauses.append("block_number >= ?")
+            params.append(from_block)
+        if to_block is not None:
+            clauses.append("block_number <= ?")
+            params.append(to_block)
+
+        sql = "SELECT * FROM deposits"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY block_number, log_index"
+
+        rows = []
+        for row in self.conn.execute(sql, params):
+            row = dict(row)
+            row['amount'] = int(row['amount'])
+            rows.append(row)
+        return rows
+
+    def deposits_for_recipient(self, recipient, chain=None):
+        return self.query(chain=chain, recipient=recipient)
+
+    def deposits_for_token(self, token, chain=None):
+        return self.query(chain=chain, token=token)
+
+    def deposits_in_blocks(self, from_block, to_block, chain=None):
+        return self.query(chain=chain, from_block=from_block, to_block=to_block)
@@ -0,0 +1,176 @@
+import threading
+import time
+
+from web3.exceptions import ContractLogicError
+
+_oracles = {}
+_lock = threading.Lock()
+
+
+class GasEstimateError(Exception):
+    """
+        Raised when a call cannot be estimated because it would revert, so it is not worth sending
+        Only raised for the first call of a function, see FeeOracle.gas_limit
+    """
+
+
+def history_fees(history):
+    """
+        Returns (next block's base fee, median priority fee) from an eth_feeHistory result
+        Empty blocks report a reward of 0 and are left out, they say nothing about the going price
+    """
+    # The last entry is the base fee of the next block
+    base_fee = history['baseFeePerGas'][-1]
+    rewards = sorted(r[0] for r, ratio in zip(history['reward'], history['gasUsedRatio']) if r and ratio > 0)
+    priority_fee = rewards[len(rewards) // 2] if rewards else 0
+    return base_fee, priority_fee
+
+
+def eip1559_fees(base_fee, priority_fee):
+    # Leave room for the base fee to double before the transaction is included
+    return {
+        'maxFeePerGas': 2 * base_fee + priority_fee,
+        'maxPriorityFeePerGas': priority_fee,
+    }
+
+
+class FeeOracle:
+    """
+        Fee and gas limit source for transactions sent on one chain
+
+        Fees are cached for ttl seconds. Where the latest block carries baseFeePerGas the fees are
+        EIP-1559 (maxFeePerGas / maxPriorityFeePerGas from eth_feeHistory), otherwise a legacy gasPrice.
+        Gas limits are estimated once per (contract, function), padded by gas_margin and reused.
+        The margin covers calls that cost more than the estimated one (e.g. a first transfer to a
+        new recipient); unused gas is refunded so a generous limit costs nothing.
+    """
+
+    def __init__(self, w3, ttl=15, history_blocks=10, reward_percentile=50, gas_margin=1.5):
+        self.w3 = w3
+        self.ttl = ttl
+        self.history_blocks = history_blocks
+        self.reward_percentile = reward_percentile
+        self.gas_margin = gas_margin
+        self.fees = None
+        self.fees_at = 0.0
+        self.gas_limits = {}
+        self.lock = threading.Lock()
+
+    def fee_params(self):
+        """
+            Returns {'maxFeePerGas', 'maxPriorityFeePerGas'} or {'gasPrice'}, refreshed at most every ttl seconds
+        """
+        with self.lock:
+            if self.fees is None or time.time() - self.fees_at > self.ttl:
+                self.fees = self.fetch_fees()
+                self.fees_at = time.time()
+            return dict(self.fees)
+
+    def fetch_fees(self):
+        try:
+            history = self.w3.eth.fee_history(self.history_blocks, 'latest', [self.reward_percentile])
+            base_fee, priority_fee = history_fees(history)
+            if base_fee is not None:
+                return eip1559_fees(base_fee, max(priority_fee, self.priority_fee_floor(base_fee)))
+        except Exception as e:
+            print(f"Fee history unavailable, using legacy gas price: {e}")
+        return {'gasPrice': self.w3.eth.gas_price}
+
+    def priority_fee_floor(self, base_fee):
+        """
+            The lowest tip the node will accept: its eth_maxPriorityFeePerGas suggestion, or the part of
+            its gasPrice above the base fee where that method is missing (BSC has a base fee of 0,
+            so a tip of a few wei from quiet blocks is rejected as underpriced)
+        """
+        try:
+            floor = self.w3.eth.max_priority_fee
+        except Exception:
+            floor = self.w3.eth.gas_price - base_fee
+        return max(floor, 1)
+
+    def gas_limit(self, contract_function, sender):
+        """
+            Returns the padded gas estimate for this contract function, estimated on first use only
+            Raises GasEstimateError when the estimate reverts, sending the call would only pay for the
+            revert. Other errors (e.g. the node being unreachable) are raised as they are
+            Since the limit is cached per function, this only guards the first call of each function:
+            later calls with other arguments are not estimated and may still revert on chain
+        """
+        key = (contract_function.address, contract_function.fn_name)
+        with self.lock:
+            if key in self.gas_limits:
+                return self.gas_limits[key]
+        try:
+            estimate = contract_function.estimate_gas({'from': sender})
+        except ContractLogicError as e:
+            raise GasEstimateError(f"{contract_function.fn_name} would revert: {e}") from e
+        limit = int(estimate * self.gas_margin)
+        with self.lock:
+            self.gas_limits[key] = limit
+        return limit
+
+    def tx_params(self, contract_function, sender):
+        """
+            Returns the transaction fields (from, gas and fees) for calling contract_function from sender
+        """
+        params = {'from': sender, 'gas': self.gas_limit(contract_function, sender)}
+        params.update(self.fee_params())
+        return params
+
+
+class AsyncFeeOracle(FeeOracle):
+    """
+        FeeOracle for an AsyncWeb3 instance, used by the async bridge
+        Same caching and fee rules, the methods are coroutines. It is only used from the event loop,
+        so the thread lock of FeeOracle is not needed
+    """
+
+    async def fee_params(self):
+        if self.fees is None or time.time() - self.fees_at > self.ttl:
+            self.fees = await self.fetch_fees()
+            self.fees_at = time.time()
+        return dict(self.fees)
+
+    async def fetch_fees(self):
+        try:
+            history = await self.w3.eth.fee_history(self.history_blocks, 'latest', [self.reward_percentile])
+            base_fee, priority_fee = history_fees(history)
+            if base_fee is not None:
+                return eip1559_fees(base_fee, max(priority_fee, await self.priority_fee_floor(base_fee)))
+        except Exception as e:
+            print(f"Fee history unavailable, using legacy gas price: {e}")
+        return {'gasPrice': await self.w3.eth.gas_price}
+
+    async def priority_fee_floor(self, base_fee):
+        try:
+            floor = await self.w3.eth.max_priority_fee
+        except Exception:
+            floor = await self.w3.eth.gas_price - base_fee
+        return max(floor, 1)
+
+    async def gas_limit(self, contract_function, sender):
+        key = (contract_function.address, contract_function.fn_name)
+        if key in self.gas_limits:
+            return self.gas_limits[key]
+        try:
+            estimate = await contract_function.estimate_gas({'from': sender})
+        except ContractLogicError as e:
+            raise GasEstimateError(f"{contract_function.fn_name} would revert: {e}") from e
+        self.gas_limits[key] = int(estimate * self.gas_margin)
+        return self.gas_limits[key]
+
+    async def tx_params(self, contract_function, sender):
+        params = {'from': sender, 'gas': await self.gas_limit(contract_function, sender)}
+        params.update(await self.fee_params())
+        return params
+
+
+def get_fee_oracle(chain, w3):
+    """
+        Returns the FeeOracle shared by everything sending on chain ('avax' or 'bsc')
+    """
+    with _lock:
+        oracle = _oracles.get(chain)
+        if oracle is None:
+            oracle = _oracles[chain] = FeeOracle(w3)
+        return oracle
@@ -5,6 +5,8 @@ import requests
 import json
 import time
 
+from connections import get_web3
+
 bayc_address = "0xBC4CA0EdA7647A8aB7C2061c2E118A18a936f13D"
 contract_address = Web3.to_checksum_address(bayc_address)
 
@@ -18,8 +20,7 @@ with open('/home/codio/workspace/abi.json', 'r') as f:
 ############################
 #Connect to an Ethereum node
 api_url = "https://mainnet.infura.io/v3/cbc1ac8fd9b14c9f8c3d8d527d835a4c"
-provider = HTTPProvider(api_url)
-web3 = Web3(provider)
+web3 = get_web3(url=api_url)
 
 def get_ape_info(apeID):
 	assert isinstance(apeID,int), f"{apeID} is not an int"
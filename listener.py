@@ -1,98 +1,199 @@
-from web3 import Web3
-from web3.contract import Contract
-from web3.providers.rpc import HTTPProvider
-from web3.middleware import geth_poa_middleware #Necessary for POA chains
 import json
-from datetime import datetime
-import pandas as pd
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from connections import get_web3, get_rate_limiter
+from event_sink import CsvEventSink
+from event_store import EventStore
+from event_decoder import EventDecoder, LogQuery
+from reorg import BlockHashCache, confirmation_depth
+from rpc_batch import endpoint_uri
 
 eventfile = 'deposit_logs.csv'
+_hash_caches = {}
+
+
+def iterLogChunks(event, start_block, end_block, initial_chunk=2000, min_chunk=1, max_chunk=50000,
+                  sparse_events=1000, probe_after=16):
+    """
+    event - anything with a get_logs(fromBlock, toBlock) method, e.g. contract.events.Deposit
+            or an event_decoder.LogQuery
+    Yields (from_block, to_block, events) for consecutive chunks covering [start_block, end_block]
+
+    Each chunk is one stateless eth_getLogs call. A chunk the node rejects (too many results,
+    range limits, timeouts) is retried at half the size, and the size doubles again after
+    chunks returning fewer than sparse_events logs, but never back up to the smallest size the
+    node rejected. Only after probe_after chunks in a row succeed just below that size is a
+    larger chunk tried again, so a node with a fixed range cap costs an occasional rejected
+    call instead of one for every chunk
+    """
+    chunk = initial_chunk
+    rejected = None
+    successes = 0
+    from_block = start_block
+    while from_block <= end_block:
+        to_block = min(from_block + chunk - 1, end_block)
+        try:
+            events = event.get_logs(fromBlock=from_block, toBlock=to_block)
+        except Exception as e:
+            if chunk <= min_chunk:
+                raise
+            rejected = chunk if rejected is None else min(rejected, chunk)
+            successes = 0
+            chunk = max(min_chunk, chunk // 2)
+            print(f"get_logs failed for blocks {from_block} - {to_block}, retrying with {chunk} blocks: {e}")
+            continue
+
+        yield from_block, to_block, events
+        from_block = to_block + 1
+        if len(events) >= sparse_events:
+            continue
+        if rejected is not None and chunk * 2 >= rejected:
+            # Doubling would reach a size the node already rejected, hold the size that works
+            successes += 1
+            if successes < probe_after:
+                continue
+            # Probe above it again, the rejection may have come from a dense range of logs
+            rejected = None
+            successes = 0
+        chunk = min(max_chunk, chunk * 2)
+
+
+class RateLimitedLogs:
+    """
+    Wraps an event so that every get_logs call, including the retries of a shrinking chunk,
+    first takes a token from limiter
+    """
+
+    def __init__(self, event, limiter):
+        self.event = event
+        self.limiter = limiter
+
+    def get_logs(self, **kwargs):
+        self.limiter.acquire()
+        return self.event.get_logs(**kwargs)
+
+
+def iterLogChunksParallel(event, start_block, end_block, chunk_size=2000, max_workers=4, limiter=None):
+    """
+    Parallel counterpart of iterLogChunks for large backfills
+    [start_block, end_block] is split into chunk_size block chunks fetched by max_workers threads
+    (each chunk still shrinks adaptively through iterLogChunks if the node rejects it).
+    Chunks are yielded in block order as soon as every earlier chunk is done, with their
+    events sorted by (blockNumber, logIndex)
+    limiter - optional connections.RateLimiter acquired before each eth_getLogs request
+    """
+    if limiter is not None:
+        event = RateLimitedLogs(event, limiter)
+
+    def fetch(from_block, to_block):
+        events = []
+        for _, _, chunk_events in iterLogChunks(event, from_block, to_block, initial_chunk=chunk_size,
+                                                max_chunk=chunk_size):
+            events.extend(chunk_events)
+        events.sort(key=lambda e: (e.blockNumber, e.logIndex))
+        return from_block, to_block, events
+
+    ranges = ((b, min(b + chunk_size - 1, end_block)) for b in range(start_block, end_block + 1, chunk_size))
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        in_flight = deque()
+        for from_block, to_block in ranges:
+            in_flight.append(pool.submit(fetch, from_block, to_block))
+            # Bound the work queued ahead of the oldest unfinished chunk
+            while len(in_flight) >= 2 * max_workers or (in_flight and in_flight[0].done()):
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+
 
-def scanBlocks(chain,start_block,end_block,contract_address):
+def scanBlocks(chain,start_block,end_block,contract_address,max_workers=1,chunk_size=2000,rate_limit=None,sink=None,store=None):
     """
     chain - string (Either 'bsc' or 'avax')
     start_block - integer first block to scan
     end_block - integer last block to scan
     contract_address - the address of the deployed contract
 
+    max_workers - with more than one worker the range is backfilled in parallel chunk_size block chunks
+    rate_limit - optional requests per second allowed on this chain's provider during a parallel backfill
+    sink - where events are appended, defaults to a CsvEventSink on "deposit_logs.csv"
+           (pass an event_sink.ParquetEventSink to write Parquet instead)
+    store - EventStore used to skip events already written to the sink, defaults to one kept next to
+            the sink (the sink's path with ".db" appended) and cleared whenever the sink starts out empty
+
 	This function reads "Deposit" events from the specified contract,
 	and writes information about the events to the file "deposit_logs.csv"
+	Returns the number of new events written
     """
-    if chain == 'avax':
-        api_url = f"https://api.avax-test.network/ext/bc/C/rpc" #AVAX C-chain testnet
-
-    if chain == 'bsc':
-        api_url = f"https://data-seed-prebsc-1-s1.binance.org:8545/" #BSC testnet
-
-    if chain in ['avax','bsc']:
-        w3 = Web3(Web3.HTTPProvider(api_url))
-        # inject the poa compatibility middleware to the innermost layer
-        w3.middleware_onion.inject(geth_poa_middleware, layer=0)
-    else:
-        w3 = Web3(Web3.HTTPProvider(api_url))
+    w3 = get_web3(chain)
 
     DEPOSIT_ABI = json.loads('[ { "anonymous": false, "inputs": [ { "indexed": true, "internalType": "address", "name": "token", "type": "address" }, { "indexed": true, "internalType": "address", "name": "recipient", "type": "address" }, { "indexed": false, "internalType": "uint256", "name": "amount", "type": "uint256" } ], "name": "Deposit", "type": "event" }]')
     contract = w3.eth.contract(address=contract_address, abi=DEPOSIT_ABI)
+    # Raw eth_getLogs results are decoded directly from their topics and data words
+    deposits = LogQuery(w3, contract.address, 'Deposit', EventDecoder([DEPOSIT_ABI]))
 
-    arg_filter = {}
-
+    # "latest" means the newest block buried under the chain's confirmation depth
     if start_block == "latest":
-        start_block = w3.eth.get_block_number()
+        start_block = w3.eth.get_block_number() - confirmation_depth(chain)
     if end_block == "latest":
-        end_block = w3.eth.get_block_number()
+        end_block = w3.eth.get_block_number() - confirmation_depth(chain)
 
     if end_block < start_block:
         print( f"Error end_block < start_block!" )
         print( f"end_block = {end_block}" )
         print( f"start_block = {start_block}" )
 
+    if sink is None:
+        sink = CsvEventSink(eventfile)
+    if store is None:
+        store = EventStore(sink.path.with_name(sink.path.name + '.db'))
+        if sink.new:
+            store.clear()
+
+    # If an earlier scan in this process ended right before start_block, make sure those blocks
+    # were not replaced by a reorg in the meantime
+    hash_cache = _hash_caches.setdefault(chain, BlockHashCache())
+    fork_block = hash_cache.check(w3, start_block)
+    if fork_block is not None:
+        removed = store.rollback(chain, fork_block)
+        print(f"Reorg detected on {chain} after block {fork_block}, removed {removed} stored events")
+        print(f"Rows already appended to {sink.path} above block {fork_block} are not removed")
+        start_block = fork_block + 1
+
     print(f"Scanning blocks {start_block} - {end_block} on {chain}")
 
-    # Initialize DataFrame
-    try:
-        df = pd.read_csv(eventfile)
-        # Rename column if it exists
-        if 'transaction_hash' in df.columns:
-            df = df.rename(columns={'transaction_hash': 'transactionHash'})
-    except FileNotFoundError:
-        df = pd.DataFrame(
-            columns=['chain', 'block_number', 'token', 'recipient', 'amount',
-                     'transactionHash'])
-
-    if end_block - start_block < 30:
-        event_filter = contract.events.Deposit.create_filter(fromBlock=start_block,toBlock=end_block,argument_filters=arg_filter)
-        events = event_filter.get_all_entries()
-        #print( f"Got {len(events)} entries for block {block_num}" )
-        # YOUR CODE HERE
-        if len(events) > 0:
+    if max_workers > 1:
+        limiter = get_rate_limiter(endpoint_uri(w3), rate_limit) if rate_limit else None
+        chunks = iterLogChunksParallel(deposits, start_block, end_block,
+                                       chunk_size=chunk_size, max_workers=max_workers, limiter=limiter)
+    else:
+        chunks = iterLogChunks(deposits, start_block, end_block)
+
+    # Events are streamed to the sink in batches, the existing file is never loaded
+    # The store drops events seen by an earlier, overlapping scan before they reach the sink
+    # and commits them only after the sink has written them out (the sink is closed first on exit),
+    # so a crash can repeat a row in the sink but never lose one
+    scanned = 0
+    with store, sink:
+        for from_block, to_block, events in chunks:
+            #print( f"Got {len(events)} entries for blocks {from_block} - {to_block}" )
             for event in events:
-                new_row = {
+                row = {
                     'chain': chain,
                     'block_number': event.blockNumber,
+                    'log_index': event.logIndex,
                     'token': event.args.token,
                     'recipient': event.args.recipient,
                     'amount': event.args.amount,
                     'transactionHash': event.transactionHash.hex()
                 }
-                df.loc[len(df)] = new_row
-    else:
-        for block_num in range(start_block,end_block+1):
-            event_filter = contract.events.Deposit.create_filter(fromBlock=block_num,toBlock=block_num,argument_filters=arg_filter)
-            events = event_filter.get_all_entries()
-            #print( f"Got {len(events)} entries for block {block_num}" )
-            # YOUR CODE HERE
-
-            if len(events) > 0:
-                for event in events:
-                    new_row = {
-                        'chain': chain,
-                        'block_number': event.blockNumber,
-                        'token': event.args.token,
-                        'recipient': event.args.recipient,
-                        'amount': event.args.amount,
-                        'transactionHash': event.transactionHash.hex()
-                    }
-                    df.loc[len(df)] = new_row
-
-    df.to_csv(eventfile, index=False)
-    return df
+                if store.add(row):
+                    rows_written = sink.rows_written
+                    sink.write(row)
+                    scanned += 1
+                    if sink.rows_written != rows_written:
+                        store.flush()
+
+    hash_cache.record_block(w3, end_block)
+    print(f"Wrote {scanned} new Deposit events")
+    return scanned
+
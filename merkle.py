@@ -0,0 +1,620 @@
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import os
+
+import numpy as np
+
+try:
+    from Crypto.Hash import keccak as _keccak
+
+    def keccak(data):
+        return _keccak.new(digest_bits=256, data=data).digest()
+except ImportError:  # pycryptodome is what web3 installs, but any eth_hash backend works
+    from eth_hash.auto import keccak as _eth_keccak
+
+    def keccak(data):
+        return _eth_keccak(bytes(data))
+
+# Levels with fewer pairs than this are hashed one pair at a time
+vector_threshold = 256
+# Pairs hashed per NumPy pass, sized so the 25 lane arrays stay in cache
+vector_chunk = 8192
+# Levels with at least this many pairs are split across worker processes in parallel mode
+parallel_threshold = 1 << 16
+
+_round_constants = [np.uint64(rc) for rc in [
+    0x0000000000000001, 0x0000000000008082, 0x800000000000808A, 0x8000000080008000,
+    0x000000000000808B, 0x0000000080000001, 0x8000000080008081, 0x8000000000008009,
+    0x000000000000008A, 0x0000000000000088, 0x0000000080008009, 0x000000008000000A,
+    0x000000008000808B, 0x800000000000008B, 0x8000000000008089, 0x8000000000008003,
+    0x8000000000008002, 0x8000000000000080, 0x000000000000800A, 0x800000008000000A,
+    0x8000000080008081, 0x8000000000008080, 0x0000000080000001, 0x8000000080008008,
+]]
+# Rotation offset of lane x + 5 * y
+_rotations = [0, 1, 62, 28, 27, 36, 44, 6, 55, 20, 3, 10, 43, 25, 39, 41, 45, 15, 21, 8, 18, 2, 61, 56, 14]
+# (source lane, destination lane, rotation, 64 - rotation) of the combined rho and pi steps
+_rho_pi = [(x + 5 * y, y + 5 * ((2 * x + 3 * y) % 5), np.uint64(_rotations[x + 5 * y]),
+            np.uint64(64 - _rotations[x + 5 * y])) for x in range(5) for y in range(5)]
+_one = np.uint64(1)
+_sixty_three = np.uint64(63)
+
+
+def keccak_f1600(A):
+    """
+        Keccak-f[1600] applied in place to many states at once
+        A - list of 25 uint64 arrays, lane x + 5 * y of every state
+    """
+    n = len(A[0])
+    B = [np.empty(n, dtype=np.uint64) for _ in range(25)]
+    C = [np.empty(n, dtype=np.uint64) for _ in range(5)]
+    D = np.empty(n, dtype=np.uint64)
+    t = np.empty(n, dtype=np.uint64)
+    xor, shl, shr = np.bitwise_xor, np.left_shift, np.right_shift
+    for rc in _round_constants:
+        # theta
+        for x in range(5):
+            c = C[x]
+            xor(A[x], A[x + 5], out=c)
+            xor(c, A[x + 10], out=c)
+            xor(c, A[x + 15], out=c)
+            xor(c, A[x + 20], out=c)
+        for x in range(5):
+            c = C[(x + 1) % 5]
+            shl(c, _one, out=D)
+            shr(c, _sixty_three, out=t)
+            np.bitwise_or(D, t, out=D)
+            xor(D, C[(x - 1) % 5], out=D)
+            for y in range(0, 25, 5):
+                xor(A[x + y], D, out=A[x + y])
+        # rho and pi
+        for src, dst, r, r_back in _rho_pi:
+            if r == 0:
+                B[dst][...] = A[src]
+            else:
+                shl(A[src], r, out=B[dst])
+                shr(A[src], r_back, out=t)
+                np.bitwise_or(B[dst], t, out=B[dst])
+        # chi
+        for y in range(0, 25, 5):
+            for x in range(5):
+                a = A[y + x]
+                np.invert(B[y + (x + 1) % 5], out=a)
+                np.bitwise_and(a, B[y + (x + 2) % 5], out=a)
+                xor(a, B[y + x], out=a)
+        # iota
+        xor(A[0], rc, out=A[0])
+
+
+def keccak_pairs(pairs):
+    """
+        Keccak256 of every 64 byte row of pairs ((n, 64) uint8 array) as an (n, 32) uint8 array
+        A 64 byte message fits in one 136 byte block, so each hash is a single permutation of a
+        state holding the 8 message words and the 0x01 ... 0x80 padding
+    """
+    n = len(pairs)
+    words = np.ascontiguousarray(pairs).view('<u8').reshape(n, 8)
+    A = [words[:, i].astype(np.uint64) for i in range(8)] + [np.zeros(n, dtype=np.uint64) for _ in range(17)]
+    A[8] ^= np.uint64(0x01)
+    A[16] ^= np.uint64(0x8000000000000000)
+    keccak_f1600(A)
+    return np.stack(A[:4], axis=1).astype('<u8').view(np.uint8).reshape(n, 32)
+
+
+class LeafRows:
+    """
+        Wraps an (n, 32) uint8 array of bytes32 values so single leaves come out as bytes
+        leaves[i] and iteration give the bytes value web3.py expects for a bytes32 argument, while
+        build_levels (through as_rows) still hashes the whole buffer without re-packing it
+    """
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return LeafRows(self.rows[index])
+        return self.rows[index].tobytes()
+
+    def __iter__(self):
+        for row in self.rows:
+            yield row.tobytes()
+
+    def __array__(self, dtype=None, copy=None):
+        return self.rows if dtype is None else self.rows.astype(dtype)
+
+
+def as_rows(leaves):
+    """
+        Returns leaves as a contiguous uint8 array of shape (n, 32)
+        leaves - a list of 32 byte values, a bytes-like buffer of n * 32 bytes, an (n, 32) array
+                 or LeafRows
+    """
+    if isinstance(leaves, LeafRows):
+        leaves = leaves.rows
+    if isinstance(leaves, np.ndarray):
+        return np.ascontiguousarray(leaves, dtype=np.uint8).reshape(-1, 32)
+    if isinstance(leaves, (bytes, bytearray, memoryview)):
+        return np.frombuffer(leaves, dtype=np.uint8).reshape(-1, 32)
+    return np.frombuffer(b''.join(bytes(leaf) for leaf in leaves), dtype=np.uint8).reshape(-1, 32)
+
+
+def encode_uint256(values):
+    """
+        Big-endian uint256 encoding of many integers as one contiguous (n, 32) uint8 array,
+        row i holding int(values[i]).to_bytes(32, 'big')
+        Rows are views into that one buffer, so leaves[i] (or memoryview(leaves[i])) is a zero-copy
+        bytes32 slice and the whole array goes into build_levels without re-packing
+    """
+    array = np.asarray(values)
+    if array.ndim == 1 and array.dtype.kind in 'iu':
+        if array.dtype.kind == 'i' and len(array) and array.min() < 0:
+            raise OverflowError("can't encode negative values as uint256")
+        rows = np.zeros((len(array), 32), dtype=np.uint8)
+        rows[:, 24:] = array.astype('>u8').view(np.uint8).reshape(-1, 8)
+        return rows
+    # Python ints wider than 64 bits (object arrays) are encoded one by one
+    return as_rows([int(v).to_bytes(32, 'big') for v in values])
+
+
+def sorted_pairs(level, out=None):
+    """
+        level - (n, 32) uint8 array
+        Returns an (ceil(n / 2), 64) array where each row is a pair of siblings, smaller one first,
+        with the last node paired with itself when n is odd (the same rules as submitProof.hash_pair)
+        The pairs are written into out when it is given
+    """
+    if len(level) % 2:
+        level = np.concatenate([level, level[-1:]])
+    left = level[0::2]
+    right = level[1::2]
+
+    # Compare rows as big-endian 64 bit words, the first differing word decides the order
+    a = np.ascontiguousarray(left).view('>u8')
+    b = np.ascontiguousarray(right).view('>u8')
+    first = (a != b).argmax(axis=1)
+    rows = np.arange(len(a))
+    right_first = (b[rows, first] < a[rows, first])[:, None]
+
+    pairs = np.empty((len(left), 64), dtype=np.uint8) if out is None else out
+    pairs[:, :32] = np.where(right_first, right, left)
+    pairs[:, 32:] = np.where(right_first, left, right)
+    return pairs
+
+
+def hash_rows(pairs, out=None):
+    """
+        Keccak256 of every 64 byte row of pairs, written into out (an (n, 32) uint8 array)
+    """
+    if out is None:
+        out = np.empty((len(pairs), 32), dtype=np.uint8)
+    if len(pairs) < vector_threshold:
+        data = np.ascontiguousarray(pairs).tobytes()
+        digests = b''.join(keccak(data[i:i + 64]) for i in range(0, len(data), 64))
+        out[:] = np.frombuffer(digests, dtype=np.uint8).reshape(-1, 32)
+        return out
+    for start in range(0, len(pairs), vector_chunk):
+        out[start:start + vector_chunk] = keccak_pairs(pairs[start:start + vector_chunk])
+    return out
+
+
+def hash_level(level):
+    """
+        Returns the parent level of level, both as (n, 32) uint8 arrays
+    """
+    return hash_rows(sorted_pairs(level))
+
+
+def _hash_shard(pairs_name, out_name, n, start, stop):
+    """
+        Worker side of hash_level_parallel, hashes pairs[start:stop] of the shared level
+    """
+    # Workers share the parent's resource tracker, the parent unlinks both blocks when the level is done
+    pairs_shm = shared_memory.SharedMemory(name=pairs_name)
+    out_shm = shared_memory.SharedMemory(name=out_name)
+    try:
+        pairs = np.ndarray((n, 64), dtype=np.uint8, buffer=pairs_shm.buf)
+        out = np.ndarray((n, 32), dtype=np.uint8, buffer=out_shm.buf)
+        hash_rows(pairs[start:stop], out[start:stop])
+        del pairs, out
+    finally:
+        pairs_shm.close()
+        out_shm.close()
+
+
+def hash_level_parallel(level, pool, workers):
+    """
+        hash_level for large levels: the sorted pairs and the parent level live in shared memory
+        and each worker process hashes a contiguous shard of rows in place
+    """
+    n = (len(level) + 1) // 2
+    pairs_shm = shared_memory.SharedMemory(create=True, size=n * 64)
+    out_shm = shared_memory.SharedMemory(create=True, size=n * 32)
+    try:
+        pairs = np.ndarray((n, 64), dtype=np.uint8, buffer=pairs_shm.buf)
+        sorted_pairs(level, out=pairs)
+        # A few shards per worker evens out scheduling, whole vector_chunks keep passes full
+        shard = -(-n // (workers * 4))
+        shard = -(-shard // vector_chunk) * vector_chunk
+        futures = [pool.submit(_hash_shard, pairs_shm.name, out_shm.name, n, start, min(start + shard, n))
+                   for start in range(0, n, shard)]
+        for future in futures:
+            future.result()
+        parent = np.ndarray((n, 32), dtype=np.uint8, buffer=out_shm.buf).copy()
+        del pairs
+        return parent
+    finally:
+        pairs_shm.close()
+        pairs_shm.unlink()
+        out_shm.close()
+        out_shm.unlink()
+
+
+def build_levels(leaves, workers=None):
+    """
+        Builds the Merkle tree over leaves level by level
+        Returns a list of (n, 32) uint8 arrays, levels[0] the leaves and levels[-1] the single root,
+        with the same root as submitProof.build_merkle
+        workers - number of processes hashing large levels in parallel (0 or None for serial,
+            -1 for one per CPU); upper levels below parallel_threshold pairs are always hashed serially
+    """
+    level = as_rows(leaves)
+    if len(level) == 0:
+        return []
+    if workers == -1:
+        workers = os.cpu_count() or 1
+
+    levels = [level]
+    pool = None
+    try:
+        while len(level) > 1:
+            if workers and workers > 1 and (len(level) + 1) // 2 >= parallel_threshold:
+                if pool is None:
+                    pool = ProcessPoolExecutor(max_workers=workers)
+                level = hash_level_parallel(level, pool, workers)
+            else:
+                level = hash_level(level)
+            levels.append(level)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return levels
+
+
+def root(levels):
+    return levels[-1][0].tobytes()
+
+
+def proof_rows(levels, indices):
+    """
+        Proofs for many leaves in one pass over the levels
+        Returns a (len(indices), len(levels) - 1, 32) uint8 array, row i being the proof of
+        leaf indices[i] in the same order as submitProof.prove_merkle
+    """
+    indices = np.asarray(indices, dtype=np.int64).copy()
+    proofs = np.empty((len(indices), max(len(levels) - 1, 0), 32), dtype=np.uint8)
+    for depth, level in enumerate(levels[:-1]):
+        siblings = indices ^ 1
+        # The last node of an odd level is paired with itself
+        siblings = np.where(siblings < len(level), siblings, indices)
+        proofs[:, depth] = level[siblings]
+        indices >>= 1
+    return proofs
+
+
+# Artifact layout: magic, level count, node count of every level, then every level's rows back to back
+_tree_magic = b'MRKL0001'
+
+
+class MerkleTree:
+    """
+        A built Merkle tree kept as its (n, 32) uint8 levels
+
+        save() writes the levels to one flat binary file and load() memory-maps it, so a tree is
+        built once and every later run serves proofs straight from the page cache. Leaves are looked
+        up through a sorted view of levels[0], letting callers ask for a proof by leaf value (or prime).
+    """
+
+    def __init__(self, levels):
+        self.levels = levels
+        self._order = None
+
+    @classmethod
+    def from_leaves(cls, leaves, workers=None):
+        return cls(build_levels(leaves, workers=workers))
+
+    def __len__(self):
+        return len(self.levels[0]) if self.levels else 0
+
+    @property
+    def root(self):
+        return root(self.levels)
+
+    def leaf(self, index):
+        return self.levels[0][index].tobytes()
+
+    def save(self, path):
+        header = np.array([len(self.levels)] + [len(level) for level in self.levels], dtype='<u8')
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(_tree_magic)
+            f.write(header.tobytes())
+            for level in self.levels:
+                f.write(np.ascontiguousarray(level).tobytes())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            if f.read(len(_tree_magic)) != _tree_magic:
+                raise ValueError(f"{path} is not a Merkle tree file")
+            num_levels = int(np.frombuffer(f.read(8), dtype='<u8')[0])
+            sizes = np.frombuffer(f.read(8 * num_levels), dtype='<u8').astype(np.int64)
+        offset = len(_tree_magic) + 8 * (num_levels + 1)
+        if num_levels == 0:
+            return cls([])
+        rows = np.memmap(path, dtype=np.uint8, mode='r', offset=offset, shape=(int(sizes.sum()), 32))
+        bounds = np.concatenate([[0], np.cumsum(sizes)])
+        return cls([rows[start:stop] for start, stop in zip(bounds[:-1], bounds[1:])])
+
+    def _sorted_leaves(self):
+        # 'S32' compares rows bytewise, the same order as comparing the bytes32 values
+        keys = self.levels[0].view('S32').ravel()
+        if self._order is None:
+            self._order = np.argsort(keys, kind='stable')
+        return keys, self._order
+
+    def indices_of(self, values):
+        """
+            values - leaves as bytes32 values or ints (e.g. primes, encoded big-endian)
+            Returns an int array with the index of every value in the leaves, -1 where it is missing
+        """
+        if len(self) == 0:
+            return np.full(len(values), -1, dtype=np.int64)
+        wanted = np.array([int(v).to_bytes(32, 'big') if isinstance(v, (int, np.integer)) else bytes(v) for v in values],
+                          dtype='S32')
+        keys, order = self._sorted_leaves()
+        positions = np.minimum(np.searchsorted(keys, wanted, sorter=order), len(keys) - 1)
+        found = order[positions]
+        return np.where(keys[found] == wanted, found, -1)
+
+    def index_of(self, value):
+        index = int(self.indices_of([value])[0])
+        return index if index >= 0 else None
+
+    def proofs(self, indices):
+        """
+            Returns the proof of every index as a list of bytes32 values, as submitProof.prove_merkle does
+        """
+        return [[node.tobytes() for node in proof] for proof in proof_rows(self.levels, indices)]
+
+    def proof(self, index):
+        if not 0 <= index < len(self):
+            return []
+        return self.proofs([index])[0]
+
+    def multi_proof(self, indices):
+        return multi_proof(self.levels, indices)
+
+    def proof_for(self, value):
+        """
+            Returns (index, proof) for a leaf given by value, or (None, []) if it is not a leaf
+        """
+        index = self.index_of(value)
+        return (index, self.proof(index)) if index is not None else (None, [])
+
+
+def hash_pair(a, b):
+    """
+        Keccak256 of two bytes32 values, smaller one first, as submitProof.hash_pair and OpenZeppelin's
+        MerkleProof compute it
+    """
+    return keccak(a + b) if a < b else keccak(b + a)
+
+
+def multi_proof(levels, indices):
+    """
+        OpenZeppelin style multiproof of the leaves at indices
+        levels - the tree as (n, 32) arrays or as lists of bytes32 values (submitProof.build_merkle)
+        Returns {'leaves', 'proof', 'proofFlags'}, the arguments MerkleProof.multiProofVerify takes
+        alongside the root, with the leaves in ascending index order
+
+        Nodes are consumed level by level in ascending order, matching the queue multiProofVerify
+        works through: a flag is True when both children of a parent are already known and False
+        when the sibling is taken from proof. A node without a sibling (last node of an odd level)
+        is hashed with itself, so its own value goes into the proof.
+    """
+    known = sorted(set(int(i) for i in indices))
+    if not levels or not known:
+        return {'leaves': [], 'proof': [], 'proofFlags': []}
+    if known[0] < 0 or known[-1] >= len(levels[0]):
+        raise IndexError(f"leaf index out of range for a tree of {len(levels[0])} leaves")
+
+    leaves = [bytes(levels[0][i]) for i in known]
+    proof = []
+    flags = []
+    for level in levels[:-1]:
+        parents = []
+        pos = 0
+        while pos < len(known):
+            index = known[pos]
+            sibling = index ^ 1
+            if index % 2 == 0 and pos + 1 < len(known) and known[pos + 1] == sibling:
+                flags.append(True)
+                pos += 2
+            else:
+                if sibling >= len(level):
+                    sibling = index
+                proof.append(bytes(level[sibling]))
+                flags.append(False)
+                pos += 1
+            parents.append(index // 2)
+        known = parents
+    return {'leaves': leaves, 'proof': proof, 'proofFlags': flags}
+
+
+def process_multi_proof(proof, proof_flags, leaves):
+    """
+        Port of MerkleProof.processMultiProof, returns the root rebuilt from leaves, proof and proof_flags
+    """
+    total_hashes = len(proof_flags)
+    if len(leaves) + len(proof) != total_hashes + 1:
+        raise ValueError("Invalid multiproof: leaves + proof must be one more than proofFlags")
+
+    hashes = []
+    leaf_pos = hash_pos = proof_pos = 0
+
+    def next_node():
+        nonlocal leaf_pos, hash_pos
+        if leaf_pos < len(leaves):
+            leaf_pos += 1
+            return bytes(leaves[leaf_pos - 1])
+        hash_pos += 1
+        return hashes[hash_pos - 1]
+
+    for flag in proof_flags:
+        a = next_node()
+        if flag:
+            b = next_node()
+        else:
+            b = bytes(proof[proof_pos])
+            proof_pos += 1
+        hashes.append(hash_pair(a, b))
+
+    if total_hashes > 0:
+        if proof_pos != len(proof):
+            raise ValueError("Invalid multiproof: unused proof elements")
+        return hashes[-1]
+    if leaves:
+        return bytes(leaves[0])
+    return bytes(proof[0])
+
+
+def multi_proof_verify(proof, proof_flags, root, leaves):
+    """
+        Port of MerkleProof.multiProofVerify, True when the leaves are proven against root
+    """
+    try:
+        return process_multi_proof(proof, proof_flags, leaves) == bytes(root)
+    except (ValueError, IndexError):
+        return False
+
+
+class IncrementalMerkleTree:
+    """
+        A Merkle tree that changes one leaf at a time
+
+        levels holds lists of bytes32 values in the same shape as submitProof.build_merkle (levels[0]
+        the leaves, levels[-1] the root), so prove_merkle and multi_proof work on it directly.
+        append() and update() rehash only the path from the leaf to the root, one hash_pair per level,
+        keeping the duplicate-last-node rule: the last node of an odd level is paired with itself
+        until a sibling is appended, and the tree grows a level when the root level reaches two nodes.
+    """
+
+    def __init__(self, leaves=(), workers=None):
+        levels = build_levels(leaves, workers=workers) if len(leaves) else []
+        self.levels = [[node.tobytes() for node in level] for level in levels]
+
+    def __len__(self):
+        return len(self.levels[0]) if self.levels else 0
+
+    @property
+    def root(self):
+        return self.levels[-1][0] if self.levels else None
+
+    def _rehash_path(self, index):
+        depth = 0
+        while len(self.levels[depth]) > 1:
+            level = self.levels[depth]
+            left = index & ~1
+            parent = hash_pair(level[left], level[left + 1] if left + 1 < len(level) else level[left])
+            if depth + 1 == len(self.levels):
+                self.levels.append([])
+            parents = self.levels[depth + 1]
+            index //= 2
+            if index == len(parents):
+                parents.append(parent)
+            else:
+                parents[index] = parent
+            depth += 1
+
+    def append(self, leaf):
+        """
+            Adds leaf (bytes32) after the last leaf, returns the new root
+        """
+        if not self.levels:
+            self.levels.append([])
+        self.levels[0].append(bytes(leaf))
+        self._rehash_path(len(self.levels[0]) - 1)
+        return self.root
+
+    def update(self, index, leaf):
+        """
+            Replaces the leaf at index, returns the new root
+        """
+        if not 0 <= index < len(self):
+            raise IndexError(f"leaf index {index} out of range for a tree of {len(self)} leaves")
+        self.levels[0][index] = bytes(leaf)
+        self._rehash_path(index)
+        return self.root
+
+    def proof(self, index):
+        """
+            Returns the proof of the leaf at index from the stored levels, without hashing
+            After an append or update every other leaf's proof changes in one element (and gains one
+            when the tree grows a level), so callers re-read the proofs they serve from here
+        """
+        if not 0 <= index < len(self):
+            return []
+        proof = []
+        for level in self.levels[:-1]:
+            sibling = index ^ 1
+            proof.append(level[sibling] if sibling < len(level) else level[index])
+            index //= 2
+        return proof
+
+    def proofs(self, indices):
+        return [self.proof(index) for index in indices]
+
+    def multi_proof(self, indices):
+        return multi_proof(self.levels, indices)
+
+    def to_merkle_tree(self):
+        """
+            Returns a MerkleTree snapshot of the current levels, e.g. to save() it
+        """
+        return MerkleTree([as_rows(level) for level in self.levels])
+
+
+def keccak_check(n=None):
+    """
+        Compares keccak_pairs (and hash_rows across a vector_chunk boundary) with pycryptodome's
+        Crypto.Hash.keccak on random and edge-case 64 byte messages
+        Run as "python merkle.py", raises AssertionError on a regression
+    """
+    from Crypto.Hash import keccak as reference
+
+    def expected(rows):
+        return [reference.new(digest_bits=256, data=row.tobytes()).digest() for row in rows]
+
+    if n is None:
+        n = vector_chunk + 3
+    rng = np.random.default_rng(0)
+    pairs = rng.integers(0, 256, size=(n, 64), dtype=np.uint8)
+    pairs[0] = 0
+    pairs[1] = 0xff
+    pairs[2, :32] = 0
+    pairs[2, 32:] = 0xff
+
+    assert [row.tobytes() for row in keccak_pairs(pairs[:64])] == expected(pairs[:64])
+    assert [row.tobytes() for row in hash_rows(pairs)] == expected(pairs)
+    # Known value: keccak256 of 64 zero bytes (the first zero-subtree hash of a keccak Merkle tree)
+    assert keccak_pairs(pairs[:1])[0].tobytes().hex() == \
+        'ad3228b676f7d3cd4284a5443f17f1962b36e491b30a40b2405849e597ba5fb5'
+    print("merkle keccak check passed")
+
+
+if __name__ == "__main__":
+    keccak_check()
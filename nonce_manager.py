@@ -0,0 +1,147 @@
+import time
+
+from rpc_batch import get_transaction_receipts
+
+
+def bump_fees(tx, gas_bump, gas_price=0):
+    """
+        Returns a copy of tx with its fees raised by gas_bump, for replacing it under the same nonce
+        gas_price - the node's current gas price, a legacy transaction never goes out below it
+    """
+    tx = dict(tx)
+    if 'maxFeePerGas' in tx:
+        tx['maxFeePerGas'] = int(tx['maxFeePerGas'] * gas_bump) + 1
+        tx['maxPriorityFeePerGas'] = int(tx['maxPriorityFeePerGas'] * gas_bump) + 1
+    else:
+        tx['gasPrice'] = max(int(tx['gasPrice'] * gas_bump) + 1, gas_price)
+    return tx
+
+
+class NonceManager:
+    """
+        Hands out nonces for a single sending account locally so that many transactions
+        can be signed and broadcast back-to-back without waiting for each one to be mined
+
+        send() assigns the next nonce, signs and broadcasts a contract call
+        wait_for_receipts() then polls every in-flight transaction together, re-broadcasting any
+        that stay unmined for longer than stuck_timeout with the same nonce and a bumped gas price
+        on_replace, if given, is called as on_replace(label, new_tx_hash) before each replacement
+        is broadcast, so the new hash is on record even if the process dies mid-send
+    """
+
+    def __init__(self, w3, account, private_key, gas_bump=1.125, stuck_timeout=90, poll_interval=2,
+                 on_replace=None):
+        self.w3 = w3
+        self.account = account
+        self.private_key = private_key
+        # Nodes reject replacements that bump the price by less than 10%
+        self.gas_bump = max(gas_bump, 1.1)
+        self.stuck_timeout = stuck_timeout
+        self.poll_interval = poll_interval
+        self.on_replace = on_replace
+        self.next_nonce = None
+        self.in_flight = {}
+
+    def sync(self):
+        """
+            Re-reads the next nonce from the node, counting transactions still in the mempool
+        """
+        self.next_nonce = self.w3.eth.get_transaction_count(self.account.address, 'pending')
+        return self.next_nonce
+
+    def send(self, contract_function, tx_params, label=None, on_signed=None, nonce=None):
+        """
+            contract_function - a bound contract function, e.g. contract.functions.wrap(token, to, amount)
+            tx_params - dictionary of transaction fields, any 'nonce' is overwritten
+            label - key the receipt is returned under by wait_for_receipts (defaults to the nonce)
+            on_signed - called as on_signed(tx_hash, nonce) after signing and before broadcasting
+            nonce - re-broadcast with this (already used) nonce instead of the next local one, so the
+                new transaction replaces any earlier one with that nonce rather than adding to it
+            Builds, signs and broadcasts the transaction, returns the tx hash
+            A new nonce is only consumed once the node has accepted the transaction, so a failed send
+            never leaves a gap
+        """
+        fresh = nonce is None
+        if fresh:
+            if self.next_nonce is None:
+                self.sync()
+            nonce = self.next_nonce
+
+        tx = contract_function.build_transaction(dict(tx_params, nonce=nonce))
+        signed_tx = self.w3.eth.account.sign_transaction(tx, self.private_key)
+        if on_signed is not None:
+            on_signed(signed_tx.hash, nonce)
+        try:
+            tx_hash = self.w3.eth.send_raw_transaction(signed_tx.rawTransaction)
+        except Exception:
+            # The account may have been used elsewhere, re-read the nonce before the next send
+            self.next_nonce = None
+            raise
+        if fresh:
+            self.next_nonce = nonce + 1
+
+        entry = self.in_flight.setdefault(nonce, {'label': nonce if label is None else label, 'hashes': []})
+        entry['tx'] = tx
+        entry['hashes'].append(tx_hash)
+        entry['sent_at'] = time.time()
+        return tx_hash
+
+    def replace(self, nonce):
+        """
+            Re-broadcasts the in-flight transaction with this nonce at a bumped gas price
+            Both the old and the new hash stay tracked since either one may end up mined
+        """
+        entry = self.in_flight[nonce]
+        gas_price = 0 if 'maxFeePerGas' in entry['tx'] else self.w3.eth.gas_price
+        tx = bump_fees(entry['tx'], self.gas_bump, gas_price)
+
+        signed_tx = self.w3.eth.account.sign_transaction(tx, self.private_key)
+        if self.on_replace is not None:
+            self.on_replace(entry['label'], signed_tx.hash)
+        tx_hash = self.w3.eth.send_raw_transaction(signed_tx.rawTransaction)
+        entry['tx'] = tx
+        entry['hashes'].append(tx_hash)
+        entry['sent_at'] = time.time()
+        print(f"Replaced stuck transaction with nonce {nonce}: {tx_hash.hex()}")
+        return tx_hash
+
+    def wait_for_receipts(self, timeout=600):
+        """
+            Polls all in-flight transactions until each has a receipt or timeout seconds pass
+            Returns a dictionary {label: receipt}, transactions still unmined at the timeout are
+            left in flight and missing from the result
+        """
+        receipts = {}
+        deadline = time.time() + timeout
+        while self.in_flight and time.time() < deadline:
+            # Look up every tracked hash (including replacements) in one batch round trip
+            hashes = [(nonce, tx_hash) for nonce in sorted(self.in_flight)
+                      for tx_hash in self.in_flight[nonce]['hashes']]
+            try:
+                found = get_transaction_receipts(self.w3, [tx_hash for _, tx_hash in hashes])
+            except Exception as e:
+                print(f"Failed to fetch receipts: {e}")
+                found = [None] * len(hashes)
+            mined = {}
+            for (nonce, _), receipt in zip(hashes, found):
+                if receipt is not None:
+                    mined[nonce] = receipt
+
+            for nonce in sorted(self.in_flight):
+                entry = self.in_flight[nonce]
+                receipt = mined.get(nonce)
+                if receipt is not None:
+                    receipts[entry['label']] = receipt
+                    del self.in_flight[nonce]
+                elif time.time() - entry['sent_at'] > self.stuck_timeout:
+                    try:
+                        self.replace(nonce)
+                    except Exception as e:
+                        # Most often "nonce too low" because one of the tracked hashes just got mined
+                        print(f"Failed to replace transaction with nonce {nonce}: {e}")
+                        entry['sent_at'] = time.time()
+
+            if self.in_flight:
+                time.sleep(self.poll_interval)
+
+        return receipts
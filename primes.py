@@ -0,0 +1,72 @@
+import math
+
+import numpy as np
+
+# Odd numbers sieved per segment, 1 MB of flags covering 2 ** 21 integers
+segment_size = 1 << 20
+
+
+def prime_upper_bound(n):
+    """
+        Returns a limit with at least n primes below it
+        For n >= 6 the n-th prime is below n (ln n + ln ln n) (Rosser's theorem)
+    """
+    if n < 6:
+        return 12
+    return int(n * (math.log(n) + math.log(math.log(n)))) + 1
+
+
+def small_primes(limit):
+    """
+        Returns the primes below limit as an int array, sieving odd numbers only
+        Used for the base primes (up to the square root of the full range), so limit stays small
+    """
+    if limit <= 2:
+        return np.array([], dtype=np.int64)
+    # is_prime[i] stands for 2 * i + 1
+    is_prime = np.ones((limit + 1) // 2, dtype=bool)
+    is_prime[0] = False
+    for i in range(1, (math.isqrt(limit - 1) - 1) // 2 + 1):
+        if is_prime[i]:
+            p = 2 * i + 1
+            is_prime[p * p // 2::p] = False
+    return np.concatenate([[2], 2 * np.flatnonzero(is_prime) + 1]).astype(np.int64)
+
+
+def first_primes(n):
+    """
+        Returns the first n primes as an int array in ascending order
+
+        Odd numbers up to prime_upper_bound(n) are sieved one segment of segment_size flags at a time,
+        crossing off multiples of the base primes with strided slices, so memory is the segment plus
+        the result whatever n is. Sieving stops at the segment where the n-th prime is found.
+    """
+    if n <= 0:
+        return np.array([], dtype=np.int64)
+    limit = prime_upper_bound(n)
+    base = small_primes(math.isqrt(limit) + 1)[1:]
+
+    found = [np.array([2], dtype=np.int64)]
+    count = 1
+    segment = np.empty(segment_size, dtype=bool)
+    # Each segment covers the odd numbers low, low + 2, ... below low + 2 * segment_size
+    for low in range(3, limit + 1, 2 * segment_size):
+        size = min(segment_size, (limit - low) // 2 + 1)
+        flags = segment[:size]
+        flags[:] = True
+        high = low + 2 * size
+        for p in base:
+            p = int(p)
+            if p * p >= high:
+                break
+            # First odd multiple of p in the segment, never below p * p
+            start = max(p * p, -(-low // p) * p)
+            if start % 2 == 0:
+                start += p
+            flags[(start - low) // 2::p] = False
+        segment_primes = low + 2 * np.flatnonzero(flags)
+        found.append(segment_primes)
+        count += len(segment_primes)
+        if count >= n:
+            break
+    return np.concatenate(found)[:n]
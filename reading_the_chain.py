@@ -1,9 +1,10 @@
 import random
 import json
-from web3 import Web3
-from web3.middleware import geth_poa_middleware
-from web3.providers.rpc import HTTPProvider
-import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
+
+from connections import get_web3, get_rate_limiter
+from rpc_batch import endpoint_uri
 
 
 # If you use one of the suggested infrastructure providers, the url will be of the form
@@ -13,7 +14,7 @@ import time
 
 def connect_to_eth():
 	url = "https://mainnet.infura.io/v3/cbc1ac8fd9b14c9f8c3d8d527d835a4c"  # FILL THIS IN
-	w3 = Web3(HTTPProvider(url))
+	w3 = get_web3(url=url)
 	assert w3.is_connected(), f"Failed to connect to provider at {url}"
 	return w3
 
@@ -28,15 +29,14 @@ def connect_with_middleware(contract_json):
 	# TODO complete this method
 	# The first section will be the same as "connect_to_eth()" but with a BNB url
 	url = "https://bsc-testnet.infura.io/v3/cbc1ac8fd9b14c9f8c3d8d527d835a4c"
-	w3 = Web3(HTTPProvider(url))
-	assert w3.is_connected(), f"Failed to connect to provider at {url}"
 
 	# The second section requires you to inject middleware into your w3 object and
 	# create a contract object. Read more on the docs pages at https://web3py.readthedocs.io/en/stable/middleware.html
 	# and https://web3py.readthedocs.io/en/stable/web3.contract.html
 
-	# Inject the middleware for Proof of Authority (PoA) consensus
-	w3.middleware_onion.inject(geth_poa_middleware, layer=0)
+	# The shared connection comes with the Proof of Authority (PoA) middleware already injected
+	w3 = get_web3(url=url, poa=True)
+	assert w3.is_connected(), f"Failed to connect to provider at {url}"
 
 	# Create a contract object using the address and ABI
 	contract = w3.eth.contract(address=address, abi=abi)
@@ -44,7 +44,17 @@ def connect_with_middleware(contract_json):
 	return w3, contract
 
 
-def is_ordered_block(w3, block_num):
+def fee_array(values):
+	"""
+	Packs wei amounts into an int64 array, falling back to an object array for values that overflow it
+	"""
+	try:
+		return np.array(values, dtype=np.int64)
+	except OverflowError:
+		return np.array(values, dtype=object)
+
+
+def is_ordered_block(w3, block_num, block=None):
 	"""
 	Takes a block number
 	Returns a boolean that tells whether all the transactions in the block are ordered by priority fee
@@ -56,50 +66,143 @@ def is_ordered_block(w3, block_num):
 		*Type 2* The priority fee is min( tx.maxPriorityFeePerGas, tx.maxFeePerGas - block.baseFeePerGas )
 
 	Conveniently, most type 2 transactions set the gasPrice field to be min( tx.maxPriorityFeePerGas + block.baseFeePerGas, tx.maxFeePerGas )
+
+	The block is fetched once with full transactions (a block already fetched that way can be passed as block)
+	and the priority fees of the whole block are computed and compared as arrays
 	"""
-	block = w3.eth.get_block(block_num)
+	if block is None:
+		block = w3.eth.get_block(block_num, full_transactions=True)
+	txs = block['transactions']
 	# If block has no transactions, consider it ordered
-	if len(block['transactions']) <= 1:
+	if len(txs) <= 1:
 		return True
 
 	# Get the London Hard Fork block number for comparison
 	london_fork = 12965000
 
-	# Initialize list to store priority fees
-	priority_fees = []
+	gas_price = fee_array([tx['gasPrice'] for tx in txs])
 
 	# Handle pre-EIP1559 blocks
 	if block_num < london_fork:
 		# Before EIP-1559, just compare gasPrice
-		for tx_hash in block['transactions']:
-			tx = w3.eth.get_transaction(tx_hash)
-			time.sleep(.2)
-			priority_fees.append(tx['gasPrice'])
+		priority_fees = gas_price
 	else:
 		# Post EIP-1559 blocks
 		base_fee = block['baseFeePerGas']
 
-		for tx_hash in block['transactions']:
-			tx = w3.eth.get_transaction(tx_hash)
-
-			# Handle Type 2 transactions (EIP-1559)
-			if 'maxFeePerGas' in tx and 'maxPriorityFeePerGas' in tx:
-				priority_fee = min(
-					tx['maxPriorityFeePerGas'],
-					tx['maxFeePerGas'] - base_fee
-				)
-			# Handle Type 0 transactions
-			else:
-				priority_fee = tx['gasPrice'] - base_fee
+		# Type 2 transactions (EIP-1559) carry maxFeePerGas and maxPriorityFeePerGas, type 0 only gasPrice
+		is_type2 = np.array(['maxFeePerGas' in tx and 'maxPriorityFeePerGas' in tx for tx in txs])
+		max_fee = fee_array([tx.get('maxFeePerGas', 0) for tx in txs])
+		max_priority_fee = fee_array([tx.get('maxPriorityFeePerGas', 0) for tx in txs])
 
-			priority_fees.append(priority_fee)
+		priority_fees = np.where(
+			is_type2,
+			np.minimum(max_priority_fee, max_fee - base_fee),
+			gas_price - base_fee
+		)
 
 	# Check if priority fees are in decreasing order
-	for i in range(len(priority_fees) - 1):
-		if priority_fees[i] < priority_fees[i + 1]:
-			return False
+	return bool(np.all(priority_fees[:-1] >= priority_fees[1:]))
+
+
+def analyze_blocks(w3, block_nums, outfile, max_workers=8, rate_limit=10):
+	"""
+	Runs is_ordered_block over many blocks with a bounded thread pool
+	w3 - web3 instance shared by the workers
+	block_nums - iterable of block numbers
+	outfile - CSV file results are appended to as "block_number,ordered,tx_count" as soon as they arrive
+	max_workers - number of blocks fetched concurrently
+	rate_limit - requests per second allowed on this provider, shared with other users of the same provider
+
+	Blocks already present in outfile are skipped, so an interrupted run resumes where it stopped
+	Returns the number of blocks analyzed by this call
+	"""
+	done = set(load_results(outfile))
+	limiter = get_rate_limiter(endpoint_uri(w3), rate_limit)
+
+	def analyze(block_num):
+		limiter.acquire()
+		block = w3.eth.get_block(block_num, full_transactions=True)
+		return block_num, is_ordered_block(w3, block_num, block=block), len(block['transactions'])
+
+	def write_result(f, future):
+		try:
+			n, ordered, tx_count = future.result()
+		except Exception as e:
+			print(f"Failed to analyze block: {e}")
+			return 0
+		f.write(f"{n},{int(ordered)},{tx_count}\n")
+		return 1
+
+	count = 0
+	with open(outfile, 'a') as f, ThreadPoolExecutor(max_workers=max_workers) as pool:
+		if f.tell() == 0:
+			f.write("block_number,ordered,tx_count\n")
+		running = set()
+		for block_num in block_nums:
+			if block_num in done:
+				continue
+			running.add(pool.submit(analyze, block_num))
+			# Keep at most 2 * max_workers blocks in flight so huge ranges do not queue up in memory
+			if len(running) >= 2 * max_workers:
+				finished, running = wait(running, return_when=FIRST_COMPLETED)
+				for future in finished:
+					count += write_result(f, future)
+				f.flush()
+
+		for future in running:
+			count += write_result(f, future)
+
+	return count
+
+
+def load_results(outfile):
+	"""
+	Reads an analyze_blocks output file, returns a dictionary {block_number: ordered}
+	"""
+	results = {}
+	try:
+		with open(outfile, 'r') as f:
+			next(f, None)
+			for line in f:
+				fields = line.strip().split(',')
+				if len(fields) == 3:
+					results[int(fields[0])] = fields[1] == '1'
+	except FileNotFoundError:
+		pass
+	return results
+
+
+def ordered_fraction(outfile, range_size=10000):
+	"""
+	Summarizes an analyze_blocks output file per block range
+	Returns a dictionary {range_start: (ordered_blocks, blocks, ordered_fraction)}
+	"""
+	counts = {}
+	for block_num, ordered in load_results(outfile).items():
+		start = block_num - block_num % range_size
+		ordered_count, total = counts.get(start, (0, 0))
+		counts[start] = (ordered_count + int(ordered), total + 1)
+	return {start: (o, t, o / t) for start, (o, t) in sorted(counts.items())}
+
 
-	return True
+def analyze_range(w3, start_block, end_block, outfile, range_size=10000, **kwargs):
+	"""
+	Analyzes every block in [start_block, end_block] and returns the ordered fraction per range_size blocks
+	"""
+	analyze_blocks(w3, range(start_block, end_block + 1), outfile, **kwargs)
+	return ordered_fraction(outfile, range_size)
+
+
+def analyze_sample(w3, n, start_block, end_block, outfile, range_size=10000, seed=None, **kwargs):
+	"""
+	Analyzes n distinct blocks drawn at random from [start_block, end_block]
+	returns the ordered fraction per range_size blocks
+	"""
+	rng = random.Random(seed)
+	block_nums = rng.sample(range(start_block, end_block + 1), n)
+	analyze_blocks(w3, block_nums, outfile, **kwargs)
+	return ordered_fraction(outfile, range_size)
 
 
 def get_contract_values(contract, admin_address, owner_address):
@@ -150,10 +253,6 @@ if __name__ == "__main__":
 	assert latest_block > london_hard_fork_block_num, f"Error: the chain never got past the London Hard Fork"
 
 	n = 5
-	for _ in range(n):
-		block_num = random.randint(1, london_hard_fork_block_num - 1)
-		ordered = is_ordered_block(block_num)
-		if ordered:
-			print(f"Block {block_num} is ordered")
-		else:
-			print(f"Block {block_num} is not ordered")
+	results = analyze_sample(eth_w3, n, 1, london_hard_fork_block_num - 1, "ordered_blocks.csv")
+	for range_start, (ordered, total, fraction) in results.items():
+		print(f"Blocks {range_start} - {range_start + 9999}: {ordered} / {total} ordered ({fraction:.1%})")
@@ -0,0 +1,215 @@
+import sqlite3
+import time
+from pathlib import Path
+
+ledger_file = "relay_ledger.db"
+
+PENDING = 'pending'
+SENT = 'sent'
+CONFIRMED = 'confirmed'
+FAILED = 'failed'
+ABANDONED = 'abandoned'
+
+def entry_status(entry):
+    """
+        What the ledger alone says about an event: 'relay', 'done' or 'abandoned', or None for a
+        sent entry whose transactions have to be looked up on the node (see RelayLedger.resolve_sent)
+    """
+    # Pending entries were never signed, the hash is recorded before anything is broadcast
+    if entry is None or entry['state'] in [PENDING, FAILED]:
+        return 'relay'
+    if entry['state'] == CONFIRMED:
+        return 'done'
+    if entry['state'] == ABANDONED:
+        return 'abandoned'
+    return None
+
+
+def relay_hashes(entry):
+    """
+        Every relay transaction hash recorded for a ledger entry (the original and its replacements)
+    """
+    return (entry.get('relay_tx_hashes') or '').split()
+
+
+class RelayLedger:
+    """
+        Records every Deposit/Unwrap event the bridge has acted on, keyed by
+        (chain, transaction hash, log index) of the event on the watched chain
+
+        Each entry moves pending -> sent -> confirmed (or failed) and keeps the hashes of its
+        relay transactions, so an event seen again by an overlapping scan is looked up
+        instead of being wrapped or withdrawn twice. Hashes are recorded as soon as the transaction
+        is signed, before it is broadcast, so a crash in between cannot hide a relay that went out.
+        The nonce of the relay is recorded with them: until the account's mined nonce passes it, the
+        event is only ever re-broadcast with that same nonce, so at most one relay can be mined.
+
+        Every revert counts as an attempt, after max_attempts the entry is abandoned: it is reported
+        and skipped instead of being retried (and paid for) on every pass
+    """
+
+    def __init__(self, path=None, max_attempts=3):
+        if path is None:
+            path = Path(__file__).with_name(ledger_file)
+        self.conn = sqlite3.connect(str(path))
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS relays (
+                chain TEXT NOT NULL,
+                tx_hash TEXT NOT NULL,
+                log_index INTEGER NOT NULL,
+                block_number INTEGER,
+                state TEXT NOT NULL,
+                relay_nonce INTEGER,
+                relay_tx_hashes TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (chain, tx_hash, log_index)
+            )
+        """)
+        self.conn.commit()
+        self.max_attempts = max_attempts
+
+    def get(self, chain, tx_hash, log_index):
+        """
+            Returns the ledger row for an event as a dictionary, or None if it was never acted on
+        """
+        row = self.conn.execute(
+            "SELECT * FROM relays WHERE chain = ? AND tx_hash = ? AND log_index = ?",
+            (chain, tx_hash, log_index)
+        ).fetchone()
+        return dict(row) if row is not None else None
+
+    def set_state(self, chain, tx_hash, log_index, state, relay_tx_hash=None, block_number=None):
+        """
+            Inserts or updates the entry for an event, fields passed as None keep their stored value
+            relay_tx_hash is added to the entry's relay hashes unless it is already one of them
+        """
+        self.conn.execute("""
+            INSERT INTO relays (chain, tx_hash, log_index, block_number, state, relay_tx_hashes, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (chain, tx_hash, log_index) DO UPDATE SET
+                state = excluded.state,
+                relay_tx_hashes = CASE
+                    WHEN excluded.relay_tx_hashes IS NULL THEN relays.relay_tx_hashes
+                    WHEN relays.relay_tx_hashes IS NULL THEN excluded.relay_tx_hashes
+                    WHEN instr(relays.relay_tx_hashes, excluded.relay_tx_hashes) > 0 THEN relays.relay_tx_hashes
+                    ELSE relays.relay_tx_hashes || ' ' || excluded.relay_tx_hashes END,
+                block_number = COALESCE(excluded.block_number, relays.block_number),
+                updated_at = excluded.updated_at
+        """, (chain, tx_hash, log_index, block_number, state, relay_tx_hash, time.time()))
+        self.conn.commit()
+
+    def mark_pending(self, chain, tx_hash, log_index, block_number=None):
+        """
+            Starts a relay attempt with a new nonce. Hashes of the earlier attempt are forgotten, only
+            call this once that attempt's nonce is used up (its relay reverted or another transaction
+            took the nonce), so none of those transactions can still be mined
+        """
+        self.set_state(chain, tx_hash, log_index, PENDING, block_number=block_number)
+        self.conn.execute(
+            "UPDATE relays SET relay_tx_hashes = NULL, relay_nonce = NULL "
+            "WHERE chain = ? AND tx_hash = ? AND log_index = ?",
+            (chain, tx_hash, log_index)
+        )
+        self.conn.commit()
+
+    def mark_sent(self, chain, tx_hash, log_index, relay_tx_hash, nonce=None):
+        """
+            Records relay_tx_hash (the first transaction or a replacement) next to any earlier hash,
+            and the nonce it was signed with
+        """
+        self.set_state(chain, tx_hash, log_index, SENT, relay_tx_hash=relay_tx_hash)
+        if nonce is not None:
+            self.conn.execute(
+                "UPDATE relays SET relay_nonce = ? WHERE chain = ? AND tx_hash = ? AND log_index = ?",
+                (nonce, chain, tx_hash, log_index)
+            )
+            self.conn.commit()
+
+    def mark_confirmed(self, chain, tx_hash, log_index, relay_tx_hash=None):
+        self.set_state(chain, tx_hash, log_index, CONFIRMED, relay_tx_hash=relay_tx_hash)
+
+    def mark_failed(self, chain, tx_hash, log_index, error=None):
+        """
+            Records a reverted relay attempt and its reason
+            Returns the new state, ABANDONED once the event has failed max_attempts times
+        """
+        entry = self.get(chain, tx_hash, log_index)
+        attempts = (entry['attempts'] if entry is not None else 0) + 1
+        state = ABANDONED if attempts >= self.max_attempts else FAILED
+        self.set_state(chain, tx_hash, log_index, state)
+        self.conn.execute(
+            "UPDATE relays SET attempts = ?, last_error = ? WHERE chain = ? AND tx_hash = ? AND log_index = ?",
+            (attempts, error, chain, tx_hash, log_index)
+        )
+        self.conn.commit()
+        return state
+
+    def resolve_sent(self, chain, tx_hash, log_index, receipts, latest_nonce, known, stuck_timeout=90):
+        """
+            Decides what to do with a sent entry from what the node reports about it
+            receipts - {relay hash: receipt} for those of its relay hashes that are mined
+            latest_nonce - the sending account's transaction count at 'latest', read before the receipts
+            known - True if the node still has one of its relay transactions (e.g. in the mempool)
+
+            Returns 'done' or 'relay' / 'abandoned' once a relay is mined (successfully or reverted),
+            'relay' if another transaction took the nonce, 'in_flight' while a relay transaction
+            is waiting in the mempool, and 'resend' when none is mined and the nonce is still free:
+            the relay must then be re-broadcast with relay_nonce, never with a new nonce
+        """
+        entry = self.get(chain, tx_hash, log_index)
+        for relay_hash in relay_hashes(entry):
+            receipt = receipts.get(relay_hash)
+            if receipt is None:
+                continue
+            if receipt['status'] == 1:
+                self.mark_confirmed(chain, tx_hash, log_index, relay_hash)
+                return 'done'
+            state = self.mark_failed(chain, tx_hash, log_index, f"reverted in {relay_hash}")
+            return 'abandoned' if state == ABANDONED else 'relay'
+
+        nonce = entry['relay_nonce']
+        if nonce is None:
+            return 'in_flight' if known else 'relay'
+        if latest_nonce > nonce:
+            # The nonce was mined but not by any of our relay transactions, none of them can be now
+            return 'relay'
+        if known and time.time() - entry['updated_at'] < stuck_timeout:
+            return 'in_flight'
+        # Dropped, stuck, or broadcast to a node that lost it
+        return 'resend'
+
+    def abandoned(self, chain=None):
+        """
+            Returns the entries given up on after max_attempts reverts, for reporting
+        """
+        sql = "SELECT * FROM relays WHERE state = ?"
+        params = [ABANDONED]
+        if chain is not None:
+            sql += " AND chain = ?"
+            params.append(chain)
+        return [dict(row) for row in self.conn.execute(sql + " ORDER BY block_number", params)]
+
+    def rollback(self, chain, after_block):
+        """
+            Forgets pending, failed and abandoned entries for events above after_block so they are judged afresh
+            when the range is rescanned after a reorg. Sent and confirmed entries are kept, since
+            their relay transactions exist regardless of the reorg, and are returned so the caller
+            can report events that may have been orphaned
+        """
+        self.conn.execute(
+            "DELETE FROM relays WHERE chain = ? AND block_number > ? AND state IN (?, ?, ?)",
+            (chain, after_block, PENDING, FAILED, ABANDONED)
+        )
+        self.conn.commit()
+        rows = self.conn.execute(
+            "SELECT * FROM relays WHERE chain = ? AND block_number > ?",
+            (chain, after_block)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def close(self):
+        self.conn.close()
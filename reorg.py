@@ -0,0 +1,98 @@
+from collections import OrderedDict
+
+# Blocks a log must be buried under before the bridge or listener acts on it
+confirmation_depths = {
+    'avax': 1,  # Snowman consensus finalizes C-chain blocks on acceptance
+    'bsc': 15,
+}
+
+
+def confirmation_depth(chain):
+    """
+        chain - 'avax' or 'bsc' (other names default to no confirmations)
+    """
+    return confirmation_depths.get(chain, 0)
+
+
+class BlockHashCache:
+    """
+        Remembers the hashes of the last size blocks a scanner has processed
+
+        Before scanning the next range, check() compares the parentHash of its first block
+        with the cached hash, a single get_block call per range. Only when they differ does it
+        walk back through the cache to find the last block both forks agree on.
+    """
+
+    def __init__(self, size=128):
+        self.size = size
+        self.hashes = OrderedDict()
+
+    def record(self, block_number, block_hash):
+        self.hashes[block_number] = block_hash
+        self.hashes.move_to_end(block_number)
+        while len(self.hashes) > self.size:
+            self.hashes.popitem(last=False)
+
+    def record_block(self, w3, block_number):
+        """
+            Fetches and records the hash of block_number, typically the last block of a scanned range
+        """
+        self.record(block_number, w3.eth.get_block(block_number)['hash'])
+
+    async def record_block_async(self, w3, block_number):
+        """
+            record_block for an AsyncWeb3 instance
+        """
+        self.record(block_number, (await w3.eth.get_block(block_number))['hash'])
+
+    def truncate(self, block_number):
+        """
+            Forgets every cached block above block_number
+        """
+        for number in [n for n in self.hashes if n > block_number]:
+            del self.hashes[number]
+
+    def check(self, w3, next_block):
+        """
+            next_block - the first block of the range about to be scanned
+            Returns None if the chain still extends the cached blocks, otherwise the last block
+            number that is unchanged on the canonical chain (everything after it must be rolled back)
+        """
+        parent_hash = self.hashes.get(next_block - 1)
+        if parent_hash is None:
+            return None
+        if w3.eth.get_block(next_block)['parentHash'] == parent_hash:
+            return None
+
+        for number in sorted(self.hashes, reverse=True):
+            if number >= next_block:
+                continue
+            if w3.eth.get_block(number)['hash'] == self.hashes[number]:
+                self.truncate(number)
+                return number
+
+        # The reorg is deeper than the cache, roll back to just before the oldest cached block
+        oldest = min(self.hashes)
+        self.hashes.clear()
+        return oldest - 1
+
+    async def check_async(self, w3, next_block):
+        """
+            check for an AsyncWeb3 instance
+        """
+        parent_hash = self.hashes.get(next_block - 1)
+        if parent_hash is None:
+            return None
+        if (await w3.eth.get_block(next_block))['parentHash'] == parent_hash:
+            return None
+
+        for number in sorted(self.hashes, reverse=True):
+            if number >= next_block:
+                continue
+            if (await w3.eth.get_block(number))['hash'] == self.hashes[number]:
+                self.truncate(number)
+                return number
+
+        oldest = min(self.hashes)
+        self.hashes.clear()
+        return oldest - 1
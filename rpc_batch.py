@@ -0,0 +1,133 @@
+import itertools
+
+from web3.datastructures import AttributeDict
+from web3.middleware import geth_poa_middleware
+from web3.middleware.geth_poa import geth_poa_cleanup
+
+import connections
+from rpc_failover import pinned_methods
+
+try:
+    from web3._utils.method_formatters import PYTHONIC_RESULT_FORMATTERS
+except ImportError:  # Formatters moved, fall back to raw JSON results
+    PYTHONIC_RESULT_FORMATTERS = {}
+
+default_batch_size = 100
+
+# Results the PoA middleware rewrites (extraData -> proofOfAuthorityData) before web3 formats them
+poa_methods = ['eth_getBlockByNumber', 'eth_getBlockByHash']
+
+_request_ids = itertools.count()
+
+
+def endpoint_uri(w3):
+    """
+        Returns the URL batches are posted to, the healthiest endpoint for a FailoverHTTPProvider
+    """
+    provider = w3.provider
+    if hasattr(provider, 'ranked_endpoints'):
+        return provider.ranked_endpoints()[0].url
+    return provider.endpoint_uri
+
+
+def uses_poa(w3):
+    return geth_poa_middleware in w3.middleware_onion
+
+
+def format_result(method, result, poa=False):
+    if result is None:
+        return None
+    if poa and method in poa_methods:
+        # PoA blocks carry more than 32 bytes of extraData, which the block formatter rejects
+        result = geth_poa_cleanup(result)
+    formatter = PYTHONIC_RESULT_FORMATTERS.get(method)
+    if formatter is not None:
+        result = formatter(result)
+    if isinstance(result, dict) and not isinstance(result, AttributeDict):
+        result = AttributeDict.recursive(result)
+    return result
+
+
+def post_batch(url, payload):
+    response = connections.get_session().post(url, json=payload, timeout=connections.request_timeout)
+    response.raise_for_status()
+    body = response.json()
+    if not isinstance(body, list):
+        # Some nodes answer a whole batch with a single error object
+        raise ValueError(f"Batch request to {url} failed: {body}")
+    return body
+
+
+def send_batch(w3, payload):
+    """
+        Posts one batch, through the endpoint ranking and health tracking of a FailoverHTTPProvider
+        when w3 has one, so a failing endpoint is skipped for batches as it is for single calls
+        Batches made only of pinned methods (e.g. receipt polling) go to the pinned endpoint
+    """
+    provider = w3.provider
+    if hasattr(provider, 'with_failover'):
+        pinned = all(request['method'] in pinned_methods for request in payload)
+        return provider.with_failover("Batch request", lambda endpoint: post_batch(endpoint.url, payload),
+                                      pinned=pinned)
+    return post_batch(provider.endpoint_uri, payload)
+
+
+def batch_request(w3, calls, batch_size=default_batch_size):
+    """
+        w3 - a web3 instance connected over HTTP
+        calls - list of (method, params) pairs, e.g. ('eth_getTransactionByHash', [tx_hash])
+        batch_size - number of calls packed into each JSON-RPC batch POST
+        Returns the results in the order of calls, formatted the same way web3 formats them
+        (None where the node returned null), raises ValueError if any call returned an error
+    """
+    poa = uses_poa(w3)
+    results = []
+    for start in range(0, len(calls), batch_size):
+        chunk = calls[start:start + batch_size]
+        payload = []
+        for method, params in chunk:
+            payload.append({'jsonrpc': '2.0', 'id': next(_request_ids), 'method': method, 'params': params})
+
+        body = send_batch(w3, payload)
+
+        # Responses may come back in any order
+        by_id = {item.get('id'): item for item in body}
+        for request, (method, _) in zip(payload, chunk):
+            item = by_id.get(request['id'])
+            if item is None:
+                raise ValueError(f"No response for {method} in batch request")
+            if 'error' in item:
+                raise ValueError(f"{method} failed: {item['error']}")
+            results.append(format_result(method, item.get('result'), poa))
+
+    return results
+
+
+def to_hex(value):
+    if isinstance(value, (bytes, bytearray)):
+        return '0x' + bytes(value).hex()
+    return value
+
+
+def get_transactions(w3, tx_hashes, batch_size=default_batch_size):
+    """
+        Batched w3.eth.get_transaction for a list of transaction hashes
+    """
+    calls = [('eth_getTransactionByHash', [to_hex(h)]) for h in tx_hashes]
+    return batch_request(w3, calls, batch_size)
+
+
+def get_transaction_receipts(w3, tx_hashes, batch_size=default_batch_size):
+    """
+        Batched w3.eth.get_transaction_receipt, entries are None for transactions not mined yet
+    """
+    calls = [('eth_getTransactionReceipt', [to_hex(h)]) for h in tx_hashes]
+    return batch_request(w3, calls, batch_size)
+
+
+def get_blocks(w3, block_numbers, full_transactions=False, batch_size=default_batch_size):
+    """
+        Batched w3.eth.get_block for a list of block numbers
+    """
+    calls = [('eth_getBlockByNumber', [hex(n), full_transactions]) for n in block_numbers]
+    return batch_request(w3, calls, batch_size)
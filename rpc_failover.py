@@ -0,0 +1,234 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from web3 import Web3
+from web3.providers.base import JSONBaseProvider
+
+# Sends and the account / mempool reads that must agree with them stay on the pinned endpoint
+# (see FailoverHTTPProvider) and are never hedged, a duplicate send is not a free read
+pinned_methods = [
+    'eth_sendRawTransaction',
+    'eth_sendTransaction',
+    'eth_getTransactionCount',
+    'eth_getTransactionByHash',
+    'eth_getTransactionReceipt',
+]
+
+
+class Endpoint:
+    """
+        One RPC endpoint with its running health statistics
+        latency is an exponentially weighted average of successful call times in seconds,
+        error_rate an exponentially weighted average of transport failures (0 to 1)
+    """
+
+    def __init__(self, url, rank, provider, smoothing=0.2):
+        self.url = url
+        self.rank = rank
+        self.provider = provider
+        self.smoothing = smoothing
+        self.latency = None
+        self.error_rate = 0.0
+        self.consecutive_errors = 0
+        self.cooldown_until = 0.0
+        self.lock = threading.Lock()
+
+    def record_success(self, elapsed):
+        with self.lock:
+            if self.latency is None:
+                self.latency = elapsed
+            else:
+                self.latency += self.smoothing * (elapsed - self.latency)
+            self.error_rate -= self.smoothing * self.error_rate
+            self.consecutive_errors = 0
+
+    def record_error(self, cooldown):
+        with self.lock:
+            self.error_rate += self.smoothing * (1 - self.error_rate)
+            self.consecutive_errors += 1
+            # Back off exponentially from an endpoint that keeps failing
+            self.cooldown_until = time.time() + cooldown * 2 ** min(self.consecutive_errors - 1, 6)
+
+    def score(self):
+        """
+            Lower is healthier, endpoints with no measurements yet are ordered by rank
+        """
+        latency = self.latency if self.latency is not None else 0.0
+        return (latency + 0.01 * self.rank) * (1 + 10 * self.error_rate)
+
+    def __repr__(self):
+        return f"Endpoint({self.url!r}, latency={self.latency}, error_rate={self.error_rate:.2f})"
+
+
+class FailoverHTTPProvider(JSONBaseProvider):
+    """
+        Web3 provider over a ranked list of HTTP endpoints for the same chain
+
+        Every call goes to the healthiest endpoint (by measured latency and error rate) that is not
+        cooling down after a failure, and falls through to the next one when the transport fails.
+        When hedge_after is set, a read that has not been answered within hedge_after seconds is
+        also sent to the next best endpoint and whichever answers first wins.
+        JSON-RPC error responses are returned as they are, only transport failures trigger failover.
+
+        Methods in pinned_methods (sends, nonces, transaction and receipt lookups) all go to one
+        pinned endpoint instead of the fastest one, so a nonce or mempool read never lands on a
+        node that has not seen our broadcast. The pin only moves when that endpoint fails.
+    """
+
+    def __init__(self, urls, session=None, request_kwargs=None, hedge_after=None, cooldown=5,
+                 max_workers=8):
+        super().__init__()
+        if not urls:
+            raise ValueError("FailoverHTTPProvider needs at least one endpoint")
+        self.endpoints = [
+            Endpoint(url, rank, Web3.HTTPProvider(url, session=session, request_kwargs=request_kwargs))
+            for rank, url in enumerate(urls)
+        ]
+        self.hedge_after = hedge_after
+        self.cooldown = cooldown
+        self.executor = ThreadPoolExecutor(max_workers=max_workers) if hedge_after is not None else None
+        self.pinned = None
+
+    def __str__(self):
+        return f"Failover HTTP connection {[e.url for e in self.endpoints]}"
+
+    def ranked_endpoints(self):
+        """
+            Endpoints ordered healthiest first, those cooling down go last
+        """
+        now = time.time()
+        return sorted(self.endpoints, key=lambda e: (e.cooldown_until > now, e.score()))
+
+    def run_on_endpoint(self, endpoint, call):
+        """
+            Runs call() against endpoint, recording its latency or the failure in the endpoint's health
+        """
+        start = time.time()
+        try:
+            response = call()
+        except Exception:
+            endpoint.record_error(self.cooldown)
+            raise
+        endpoint.record_success(time.time() - start)
+        return response
+
+    def call_endpoint(self, endpoint, method, params):
+        return self.run_on_endpoint(endpoint, lambda: endpoint.provider.make_request(method, params))
+
+    def with_failover(self, description, call, pinned=False):
+        """
+            Runs call(endpoint) on the healthiest endpoint and falls through to the next one on failure
+            With pinned=True the pinned endpoint is tried first and whichever endpoint answers becomes
+            the pin. Used for single calls and by rpc_batch for JSON-RPC batches
+        """
+        endpoints = self.ranked_endpoints()
+        pin = self.pinned
+        if pinned and pin is not None:
+            endpoints.remove(pin)
+            endpoints.insert(0, pin)
+
+        last_error = None
+        for endpoint in endpoints:
+            try:
+                response = self.run_on_endpoint(endpoint, lambda: call(endpoint))
+            except Exception as e:
+                last_error = e
+                print(f"{description} failed on {endpoint.url}: {e}")
+                continue
+            if pinned:
+                self.pinned = endpoint
+            return response
+        raise last_error
+
+    def make_request(self, method, params):
+        if method in pinned_methods:
+            return self.with_failover(f"RPC call {method}",
+                                      lambda endpoint: endpoint.provider.make_request(method, params), pinned=True)
+        endpoints = self.ranked_endpoints()
+        if self.executor is not None and len(endpoints) > 1:
+            return self.make_hedged_request(endpoints, method, params)
+        return self.with_failover(f"RPC call {method}",
+                                  lambda endpoint: endpoint.provider.make_request(method, params))
+
+    def make_hedged_request(self, endpoints, method, params):
+        """
+            Starts on the best endpoint and adds the next one each time hedge_after seconds pass
+            without an answer, or immediately when a running call fails
+        """
+        remaining = list(endpoints)
+        running = set()
+        last_error = None
+        while remaining or running:
+            if remaining:
+                running.add(self.executor.submit(self.call_endpoint, remaining.pop(0), method, params))
+            done, running = wait(running, timeout=self.hedge_after if remaining else None,
+                                 return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    return future.result()
+                except Exception as e:
+                    last_error = e
+        raise last_error
+
+    def is_connected(self, show_traceback=False):
+        return any(e.provider.is_connected() for e in self.ranked_endpoints())
+
+
+def stub_check():
+    """
+        Exercises failover and endpoint pinning against two local stub JSON-RPC servers
+        Run as "python rpc_failover.py", raises AssertionError on a regression
+    """
+    import json
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+    calls = []
+
+    def make_handler(name):
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                calls.append((name, request['method']))
+                body = json.dumps({'jsonrpc': '2.0', 'id': request['id'], 'result': '0x1'}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+        return Handler
+
+    servers = {name: HTTPServer(('127.0.0.1', 0), make_handler(name)) for name in ['a', 'b']}
+    for server in servers.values():
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    urls = {name: f"http://127.0.0.1:{server.server_port}" for name, server in servers.items()}
+    provider = FailoverHTTPProvider([urls['a'], urls['b']], cooldown=60)
+    a, b = provider.endpoints
+
+    # Account reads pin to the endpoint that answered first
+    provider.make_request('eth_getTransactionCount', ['0x0', 'pending'])
+    assert calls[-1] == ('a', 'eth_getTransactionCount') and provider.pinned is a
+
+    # b becomes the fastest endpoint: plain reads follow it, pinned methods stay on a
+    a.latency, b.latency = 1.0, 0.001
+    provider.make_request('eth_blockNumber', [])
+    assert calls[-1] == ('b', 'eth_blockNumber')
+    provider.make_request('eth_sendRawTransaction', ['0x00'])
+    provider.make_request('eth_getTransactionByHash', ['0x00'])
+    assert calls[-2:] == [('a', 'eth_sendRawTransaction'), ('a', 'eth_getTransactionByHash')]
+
+    # a goes down: pinned calls fail over to b and the pin moves there
+    servers['a'].shutdown()
+    servers['a'].server_close()
+    provider.make_request('eth_getTransactionCount', ['0x0', 'latest'])
+    assert calls[-1] == ('b', 'eth_getTransactionCount') and provider.pinned is b
+    assert a.consecutive_errors == 1
+    servers['b'].shutdown()
+    print("rpc_failover stub check passed")
+
+
+if __name__ == "__main__":
+    stub_check()
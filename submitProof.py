@@ -4,10 +4,18 @@ import string
 import json
 from pathlib import Path
 
+import numpy as np
+
 from eth_account import Account
 from eth_account.messages import encode_defunct
 from web3 import Web3
-from web3.middleware import geth_poa_middleware  # Necessary for POA chains
+
+from connections import get_web3
+from fee_oracle import get_fee_oracle
+from merkle import LeafRows, MerkleTree, build_levels, encode_uint256, multi_proof, multi_proof_verify
+from primes import first_primes
+
+tree_file = "merkle_tree.bin"
 
 
 def merkle_assignment():
@@ -17,19 +25,14 @@ def merkle_assignment():
         ready to attempt to claim a prime. You will need to complete the
         methods called by this method to generate the proof.
     """
-    # Generate the list of primes as integers
+    # Load the Merkle tree over the first num_of_primes primes (bytes32 leaves),
+    # built and saved on the first run only
     num_of_primes = 8192
-    primes = generate_primes(num_of_primes)
-
-    # Create a version of the list of primes in bytes32 format
-    leaves = convert_leaves(primes)
-
-    # Build a Merkle tree using the bytes32 leaves as the Merkle tree's leaves
-    tree = build_merkle(leaves)
+    tree = load_merkle_tree(num_of_primes)
 
     # Select a random leaf and create a proof for that leaf
     random_leaf_index = 0 #TODO generate a random index from primes to claim (0 is already claimed)
-    proof = prove_merkle(tree, random_leaf_index)
+    proof = tree.proof(random_leaf_index)
 
     # This is the same way the grader generates a challenge for sign_challenge()
     challenge = ''.join(random.choice(string.ascii_letters) for i in range(32))
@@ -40,79 +43,67 @@ def merkle_assignment():
         tx_hash = '0x'
         # TODO, when you are ready to attempt to claim a prime (and pay gas fees),
         #  complete this method and run your code with the following line un-commented
-        tx_hash = send_signed_msg(proof, leaves[random_leaf_index])
+        tx_hash = send_signed_msg(proof, tree.leaf(random_leaf_index))
 
 
 def generate_primes(num_primes):
     """
         Function to generate the first 'num_primes' prime numbers
-        returns list (with length n) of primes (as ints) in ascending order
+        returns array (with length n) of primes (as ints) in ascending order
     """
-    sieve_size = num_primes * 20
-    sieve = [True] * sieve_size
-    sieve[0] = sieve[1] = False
-
-    primes_list = []
-    for i in range(2, sieve_size):
-        if len(primes_list) >= num_primes:
-            break
-
-        if sieve[i]:
-            primes_list.append(i)
-            # Mark multiples as non-prime
-            for j in range(i * i, sieve_size, i):
-                sieve[j] = False
-
-    return primes_list[:num_primes]
+    # Segmented odd-only NumPy sieve up to the n-th prime bound, see primes.first_primes
+    return first_primes(num_primes)
 
 
 def convert_leaves(primes_list):
     """
         Converts the leaves (primes_list) to bytes32 format
-        returns list of primes where list entries are bytes32 encodings of primes_list entries
+        returns a sequence where leaves[i] is the bytes32 (big-endian) encoding of primes_list[i] as bytes
+        The leaves share one (n, 32) uint8 buffer, which build_merkle hashes without re-packing
     """
-
-    bytes32_leaves = []
-    for prime in primes_list:
-        # Convert to bytes32 using big-endian encoding
-        bytes32 = prime.to_bytes(32, 'big')
-        # Convert to hex string format that web3.py expects
-        bytes32_leaves.append(bytes32)
-    return bytes32_leaves
+    return LeafRows(encode_uint256(primes_list))
 
 
-def build_merkle(leaves):
+def build_merkle(leaves, workers=None):
     """
         Function to build a Merkle Tree from the list of prime numbers in bytes32 format
         Returns the Merkle tree (tree) as a list where tree[0] is the list of leaves,
         tree[1] is the parent hashes, and so on until tree[n] which is the root hash
         the root hash produced by the "hash_pair" helper function
+        workers - hash the large lower levels in that many processes (-1 for one per CPU)
     """
 
-    if not leaves:
+    if len(leaves) == 0:
         return []
 
-    tree = [leaves]
-    current_level = leaves
-
-    # Continue building levels until we reach the root
-    while len(current_level) > 1:
-        next_level = []
-        # Process pairs of nodes
-        for i in range(0, len(current_level), 2):
-            # If we have an odd number of elements, duplicate the last one
-            if i + 1 >= len(current_level):
-                next_level.append(
-                    hash_pair(current_level[i], current_level[i]))
-            else:
-                next_level.append(
-                    hash_pair(current_level[i], current_level[i + 1]))
-        tree.append(next_level)
-        current_level = next_level
+    # Each level is hashed as one contiguous (n, 32) array of sorted 64 byte pairs,
+    # see merkle.build_levels, and handed back as lists of bytes32 values
+    levels = build_levels(leaves, workers=workers)
+    tree = [[node.tobytes() for node in level] for level in levels]
 
     return tree
 
 
+def load_merkle_tree(num_of_primes):
+    """
+        Returns a MerkleTree over the first num_of_primes primes, memory-mapped from tree_file
+        The tree is built from generate_primes / convert_leaves and saved when the file is missing
+        or its leaves are not exactly those leaves (a different number of primes or another encoding)
+        Proofs for many leaves at once come from tree.proofs(indices), and tree.proof_for(prime)
+        looks the leaf up by value
+    """
+    path = Path(__file__).parent.absolute().joinpath(tree_file)
+    leaves = convert_leaves(generate_primes(num_of_primes))
+    if path.exists():
+        tree = MerkleTree.load(path)
+        if len(tree) == num_of_primes and np.array_equal(tree.levels[0], leaves.rows):
+            return tree
+
+    tree = MerkleTree.from_leaves(leaves)
+    tree.save(path)
+    return tree
+
+
 def prove_merkle(merkle_tree, random_indx):
     """
         Takes a random_index to create a proof of inclusion for and a complete Merkle tree
@@ -146,6 +137,26 @@ def prove_merkle(merkle_tree, random_indx):
     return merkle_proof
 
 
+def prove_merkle_multi(merkle_tree, indices):
+    """
+        Takes a list of leaf indices and a complete Merkle tree (as returned by build_merkle)
+        Returns a multiproof {'leaves', 'proof', 'proofFlags'} for all of them at once,
+        the arguments of OpenZeppelin's MerkleProof.multiProofVerify
+        Siblings shared between the leaves are hashed on the fly instead of sent in the proof
+    """
+    return multi_proof(merkle_tree, indices)
+
+
+def verify_merkle_multi(merkle_tree, multiproof):
+    """
+        Checks a multiproof from prove_merkle_multi against the root of merkle_tree
+        the same way multiProofVerify does on chain
+    """
+    if not merkle_tree:
+        return False
+    return multi_proof_verify(multiproof['proof'], multiproof['proofFlags'], merkle_tree[-1][0], multiproof['leaves'])
+
+
 def sign_challenge(challenge):
     """
         Takes a challenge (string)
@@ -184,15 +195,13 @@ def send_signed_msg(proof, random_leaf):
 
     # Prepare the transaction to call the submit function
     # The contract expects the proof and the leaf value
-    tx = contract.functions.submit(
-        proof,  # The Merkle proof
-        random_leaf  # The leaf we're proving (in bytes32 format)
-    ).build_transaction({
-        'from': acct.address,
-        'gas': 200000,  # Adjust gas as needed
-        'gasPrice': w3.eth.gas_price,
-        'nonce': nonce,
-    })
+    submit = contract.functions.submit(
+        [bytes(node) for node in proof],  # The Merkle proof
+        bytes(random_leaf)  # The leaf we're proving (in bytes32 format)
+    )
+    # Estimated gas limit and cached (EIP-1559 where supported) fees
+    tx_params = get_fee_oracle(chain, w3).tx_params(submit, acct.address)
+    tx = submit.build_transaction(dict(tx_params, nonce=nonce))
 
     # Sign and send the transaction
     signed_tx = w3.eth.account.sign_transaction(tx, acct.key)
@@ -213,15 +222,7 @@ def connect_to(chain):
     if chain not in ['avax','bsc']:
         print(f"{chain} is not a valid option for 'connect_to()'")
         return None
-    if chain == 'avax':
-        api_url = f"https://api.avax-test.network/ext/bc/C/rpc"  # AVAX C-chain testnet
-    else:
-        api_url = f"https://data-seed-prebsc-1-s1.binance.org:8545/"  # BSC testnet
-    w3 = Web3(Web3.HTTPProvider(api_url))
-    # inject the poa compatibility middleware to the innermost layer
-    w3.middleware_onion.inject(geth_poa_middleware, layer=0)
-
-    return w3
+    return get_web3(chain)
 
 
 def get_account():
@@ -276,6 +277,8 @@ def hash_pair(a, b):
         Another potential gotcha, if you have a prime number (as an int) bytes(prime) will *not* give you the byte representation of the integer prime
         Instead, you must call int.to_bytes(prime,'big').
     """
+    # Leaves may come in as uint8 array rows, which neither compare nor ABI encode as bytes32
+    a, b = bytes(a), bytes(b)
     if a < b:
         return Web3.solidity_keccak(['bytes32', 'bytes32'], [a, b])
     else:
@@ -0,0 +1,76 @@
+import asyncio
+import itertools
+import json
+
+import websockets
+
+_request_ids = itertools.count(1)
+
+
+class HeadSubscription:
+    """
+        Keeps an eth_subscribe("newHeads") WebSocket subscription open for one chain
+
+        run() connects, subscribes and records the number of every new head, reconnecting with
+        exponential backoff whenever the socket drops. Scanners call wait_for_head() instead of
+        sleeping, so they wake up as soon as a block arrives; while the socket is down it simply
+        times out and the caller falls back to polling. Nothing is lost across a reconnect because
+        scanners always resume from their checkpoint, which fills the gap with ranged eth_getLogs.
+    """
+
+    def __init__(self, url, reconnect_delay=1, max_reconnect_delay=60):
+        self.url = url
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.head = None
+        self.connected = False
+        self.new_head = asyncio.Event()
+
+    async def subscribe(self, ws, params):
+        request_id = next(_request_ids)
+        await ws.send(json.dumps({'jsonrpc': '2.0', 'id': request_id, 'method': 'eth_subscribe', 'params': params}))
+        while True:
+            message = json.loads(await ws.recv())
+            if message.get('id') == request_id:
+                if 'error' in message:
+                    raise ValueError(f"eth_subscribe failed: {message['error']}")
+                return message['result']
+
+    async def run(self):
+        delay = self.reconnect_delay
+        while True:
+            try:
+                async with websockets.connect(self.url) as ws:
+                    subscription = await self.subscribe(ws, ['newHeads'])
+                    self.connected = True
+                    delay = self.reconnect_delay
+                    print(f"Subscribed to new heads at {self.url}")
+                    async for raw in ws:
+                        message = json.loads(raw)
+                        params = message.get('params', {})
+                        if message.get('method') != 'eth_subscription' or params.get('subscription') != subscription:
+                            continue
+                        self.head = int(params['result']['number'], 16)
+                        self.new_head.set()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"WebSocket subscription to {self.url} dropped: {e}")
+
+            self.connected = False
+            # Wake any waiter so it notices the fallback to polling right away
+            self.new_head.set()
+            await asyncio.sleep(delay)
+            delay = min(self.max_reconnect_delay, delay * 2)
+
+    async def wait_for_head(self, timeout):
+        """
+            Waits up to timeout seconds for a new head, returns the latest head number while the
+            subscription is live and None when the caller should poll instead
+        """
+        try:
+            await asyncio.wait_for(self.new_head.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self.new_head.clear()
+        return self.head if self.connected else None